@@ -0,0 +1,140 @@
+import numpy as np
+
+from calculation.EmissionEngine import SPECIES, integration_steps
+
+'''
+3-D inventory of where the emissions are released: every segment adds what it emitted (the same
+trapezoid steps as the totals) to the lat x lon x altitude cell of its end point
+
+the grid has a fixed size, so the memory does not grow with the number of flights. Grids made by
+different processes (or months) with the same cells can be added together with merge / merge_grids.
+'''
+
+
+class EmissionGrid:
+    '''
+    data[s, i, j, k]: tons of species SPECIES[s] emitted in latitude cell i, longitude cell j and altitude cell k
+
+    region: (min_lat, max_lat, min_lon, max_lon) like the region of the filters
+    dlat, dlon (deg), dalt (ft): size of the cells, altitudes from 0 to max_alt
+    emissions outside the grid (or at an unknown position) are only counted in outside
+    '''
+    def __init__(self, region=(37.623, 69.896, -23.723, 31.823), dlat=0.5, dlon=0.5, dalt=2000, max_alt=46000,
+                 edges=None):
+        if edges is None:
+            min_lat, max_lat, min_lon, max_lon = region
+            edges = (np.arange(min_lat, max_lat + dlat, dlat), np.arange(min_lon, max_lon + dlon, dlon),
+                     np.arange(0, max_alt + dalt, dalt))
+        self.edges = tuple(np.asarray(edge, dtype=float) for edge in edges)
+        self.shape = tuple(len(edge) - 1 for edge in self.edges)
+        self.data = np.zeros((len(SPECIES),) + self.shape)
+        self.outside = np.zeros(len(SPECIES))
+        self.flights = 0
+
+    def _cells(self, lat, lon, alt):
+        """
+        flat cell number of every point, -1 outside the grid
+        """
+        index = []
+        inside = np.ones(len(lat), dtype=bool)
+        for values, edge in zip((lat, lon, alt), self.edges):
+            i = np.searchsorted(edge, np.asarray(values, dtype=float), side="right") - 1
+            inside &= (i >= 0) & (i < len(edge) - 1)
+            index.append(np.clip(i, 0, len(edge) - 2))
+        cells = np.ravel_multi_index(index, self.shape)
+        cells[~inside] = -1
+        return cells
+
+    def add(self, lat, lon, alt, emissions):
+        """
+        adds the emissions (points x species, tons) released at the given positions (deg, deg, ft)
+        """
+        emissions = np.asarray(emissions, dtype=float).reshape(len(lat), len(SPECIES))
+        emissions = np.where(np.isfinite(emissions), emissions, 0)
+        cells = self._cells(lat, lon, alt)
+        inside = cells >= 0
+        # only the cells that are hit are summed, so a flight costs its number of segments and not the size of the grid
+        used, inverse = np.unique(cells[inside], return_inverse=True)
+        flat = self.data.reshape(len(SPECIES), -1)
+        for s in range(len(SPECIES)):
+            flat[s, used] += np.bincount(inverse, weights=emissions[inside, s], minlength=len(used))
+        self.outside += emissions[~inside].sum(axis=0)
+
+    def add_segments(self, lat, lon, alt, rates, time_diffs, offsets=None):
+        """
+        adds the segments of one flight (or of concatenated flights with offsets, see integrate_rates)
+        from their emission rates (segments x species, tons/s)
+        """
+        # the same steps as the totals, the first segment of every flight adds nothing
+        self.add(lat, lon, alt, integration_steps(rates, time_diffs, offsets))
+        self.flights += 1 if offsets is None else len(offsets) - 1
+
+    def add_flight(self, flight):
+        """
+        adds a computed Flight (rates in its segment array)
+        """
+        self._addSegmentArray(flight.seg)
+
+    def add_store(self, store, IDs=None):
+        """
+        adds the flights of a SegmentStore (all of them or only IDs), for example to rebuild the grid of an interrupted run
+
+        returns the IDs that are not in the store
+        """
+        missing = []
+        for ID in store.keys() if IDs is None else IDs:
+            if ID in store:
+                self._addSegmentArray(store[ID])
+            else:
+                missing.append(ID)
+        return missing
+
+    def _addSegmentArray(self, seg):
+        rates = np.column_stack([seg[name + "rate"] for name in SPECIES])
+        self.add_segments(seg['lat'], seg['lon'], seg['alt'], rates, seg['time_diffs'])
+
+    def merge(self, other):
+        """
+        adds another grid with the same cells (for example the grid of another worker)
+        """
+        if len(other.edges) != len(self.edges) or not all(np.array_equal(a, b) for a, b in zip(self.edges, other.edges)):
+            raise ValueError("only grids with the same cells can be merged")
+        self.data += other.data
+        self.outside += other.outside
+        self.flights += other.flights
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def total(self, name):
+        """
+        everything added for one species (tons), inside and outside the grid
+        """
+        s = SPECIES.index(name)
+        return self.data[s].sum() + self.outside[s]
+
+    def save(self, path):
+        np.savez_compressed(path, data=self.data, outside=self.outside, flights=self.flights, species=np.array(SPECIES),
+                            lat=self.edges[0], lon=self.edges[1], alt=self.edges[2])
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            if tuple(f["species"]) != SPECIES:
+                raise ValueError(f"{path} has the species {tuple(f['species'])}, expected {SPECIES}")
+            grid = cls(edges=(f["lat"], f["lon"], f["alt"]))
+            grid.data[...] = f["data"]
+            grid.outside[...] = f["outside"]
+            grid.flights = int(f["flights"])
+        return grid
+
+
+def merge_grids(paths):
+    """
+    loads and adds up saved grids (for example of several workers or months)
+    """
+    grid = None
+    for path in paths:
+        grid = EmissionGrid.load(path) if grid is None else grid.merge(EmissionGrid.load(path))
+    return grid
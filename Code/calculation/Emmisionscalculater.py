@@ -1,10 +1,11 @@
 import pandas as pd
 import os
-from openap import FuelFlow, Emission
 import matplotlib.pyplot as plt
 import numpy as np
 import sys
 import csv
+import argparse
+from multiprocessing import Pool
 
 from tqdm import tqdm
 
@@ -12,82 +13,189 @@ from tqdm import tqdm
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 #custom modules
-from preprocessing.preProcess import extract_ECTRLIDSeq
-from preprocessing.AircraftIDandType import AircraftDictionary_Eurocontrol_and_Aircraft 
-from preprocessing.AirportClassifier import Aiport_Classifier
+from preprocessing.preProcess import extract_ECTRLIDSeq, stream_ECTRLIDSeq, format_epoch, EPOCH_COLUMN
+from preprocessing.FlightStore import FlightStore
+from preprocessing.AircraftIDandType import registry_for_folder
+from preprocessing.AirportClassifier import airport_resolver
 from preprocessing.AircraftIDandType import aircraft_dict 
 from preprocessing.AircraftIDandType import aircraft_dict_mass
+from calculation.EmissionEngine import EmissionEngine, integrate_rates, SPECIES
+from calculation.ModelPool import get_fuelflow, get_emission, pool_stats, warm
+from calculation.FleetKernel import compute_fleet, haul_type
+from calculation.FuelFlowSurrogate import fuelflow_surrogate
+from calculation.ResultSink import ResultSink
+from calculation.ResultCache import ResultCache, flight_key
+from calculation.Kinematics import kinematics
+from calculation.SegmentStore import SegmentWriter, SegmentStore
+from calculation.EmissionGrid import EmissionGrid
 
 
 #############################################################################################################################################################
+#per segment values of a flight, segment i runs from point i to point i+1 (lat, lon and alt are the ones of point i+1)
+SEGMENT_FIELDS = ("time_diffs", "time_cum", "lat", "lon", "alt", "DistHor", "DistVert", "spdHor", "spdVert", "FF",
+                  "CO2rate", "H2Orate", "NOxrate", "COrate", "HCrate", "CO2", "H2O", "NOx", "CO", "HC")
+
+def segment_dtype(dtype=np.float64):
+    """
+    the structured dtype holding all segment values of a flight (float64 or float32)
+    """
+    return np.dtype([(name, dtype) for name in SEGMENT_FIELDS])
+
+def _segmentField(name):
+    """
+    attribute that reads and writes one field of the segment array
+    """
+    def get(self):
+        return self.seg[name]
+    def set(self, value):
+        self.seg[name] = value
+    return property(get, set)
+
 #Make a class for a flight
 
 class Flight:
-    def __init__(self, EURCTRLID, Data):
-        """Initialize a Flight object with minimal picklable attributes."""
-        self.CO2, self.H2O, self.NOx, self.HC, self.CO = [None] * 5
-        self.CO2rate, self.H2Orate, self.NOxrate, self.HCrate, self.COrate = [None] * 5
+    # only these attributes exist, all the arrays live in the single structured array seg
+    __slots__ = ("ID", "type", "mass", "airports", "t0", "start", "seg", "totals", "fuelFlow", "emission")
+
+    time_diffs = _segmentField("time_diffs")
+    time_cum = _segmentField("time_cum")
+    DistHor = _segmentField("DistHor")
+    DistVert = _segmentField("DistVert")
+    spdHor = _segmentField("spdHor")
+    spdVert = _segmentField("spdVert")
+    FF = _segmentField("FF")
+    CO2rate, H2Orate, NOxrate, COrate, HCrate = (_segmentField(name) for name in ("CO2rate", "H2Orate", "NOxrate", "COrate", "HCrate"))
+    CO2, H2O, NOx, CO, HC = (_segmentField(name) for name in ("CO2", "H2O", "NOx", "CO", "HC"))
+
+    def __init__(self, EURCTRLID, Data, registry, airports=None, dtype=np.float64):
+        """Initialize a Flight object with minimal picklable attributes.
+
+        registry is the ECTRL ID -> aircraft type lookup of the month (see AircraftRegistry)
+        airports can be given when they were already resolved for the whole month (AirportResolver.resolve_flights)
+        dtype=np.float32 halves the memory of the segment array (for keeping a whole month in memory)
+        """
         self.ID = EURCTRLID
+        self.fuelFlow, self.emission = None, None
 
         # Check if aircraft type is supported
-        type_raw = AircraftDictionary_Eurocontrol_and_Aircraft.get(EURCTRLID)
+        type_raw = registry.get(EURCTRLID)
         if type_raw not in aircraft_dict:
             raise ValueError(f"Aircraft: {type_raw} not supported")
 
         self.type = aircraft_dict[type_raw]
         self.mass = aircraft_dict_mass[self.type]
 
-        # Store flight data
-        self.flightData = Data[self.ID].drop_duplicates(subset=['Time Over']).reset_index(drop=True)
+        # Store flight data: the first point and the end points of every segment
+        points = self.dropDuplicateTimes(Data[self.ID])
+        epoch = points[EPOCH_COLUMN]
+        self.t0 = int(epoch[0])
+        self.start = (float(points['Latitude'][0]), float(points['Longitude'][0]), float(points['Flight Level'][0]) * 100)
+        self.seg = np.full(len(epoch) - 1, np.nan, dtype=segment_dtype(dtype)) # emissions stay nan until computed
+        self.totals = np.full(len(SPECIES), np.nan) # total emission per species (tons), in the order of SPECIES
+        self.seg['lat'] = points['Latitude'][1:]
+        self.seg['lon'] = points['Longitude'][1:]
 
-        # Compute initial parameters
-        self.airports = self.Findairports(init=False)
-        self.time_diffs = self.calcTimeDiffs()
-        self.time_cum = np.cumsum(self.time_diffs)
-        self.DistHor = self.calcDistHorizontal()
-        self.alts = np.array(self.flightData['Flight Level']) * 100
-        self.DistVert = self.calcDistVertical()
-        self.spdHor = self.calcSpdHorizontal()
-        self.spdVert = self.calcSpdVertical()
+        # Compute initial parameters: times, distances and speeds in one pass straight into the segment array
+        kinematics(points['Latitude'], points['Longitude'], points['Flight Level'], epoch, out=self.seg)
+        self.airports = airports if airports is not None else self.Findairports(init=False)
 
         # Fuel Flow & Emission objects are NOT initialized here to avoid pickling issues
 
-    def initialize_emission(self):
-        """Does the openAP calculations after setting up base parameters."""
+    @classmethod
+    def from_segments(cls, EURCTRLID, seg, ac, t0, start, totals, airports=None):
+        """
+        a computed flight rebuilt from its stored segment array (see SegmentStore), nothing is computed
+        and seg is used as it is (a read-only view of the memory-mapped store)
+
+        ac is the openap type, t0 the first epoch and start (lat, lon, alt ft) the first point
+        """
+        flight = cls.__new__(cls)
+        flight.ID, flight.type, flight.mass = EURCTRLID, ac, aircraft_dict_mass.get(ac)
+        flight.t0, flight.start, flight.seg = t0, start, seg
+        flight.totals = np.asarray(totals, dtype=float)
+        flight.airports = airports
+        flight.fuelFlow, flight.emission = None, None
+        return flight
+
+    def __getstate__(self):
+        """the openap objects can not be pickled, they are left out (as before initialize_emission)"""
+        return {name: getattr(self, name) for name in self.__slots__ if name not in ("fuelFlow", "emission")}
+
+    def __setstate__(self, state):
+        self.fuelFlow, self.emission = None, None
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @property
+    def alts(self):
+        """
+        altitude of every point (ft)
+        """
+        return np.concatenate(([self.start[2]], self.seg['alt']))
+
+    @property
+    def flightData(self):
+        """
+        the (deduplicated) flightpoints rebuilt from the segment array as {column: array}
+        """
+        return {EPOCH_COLUMN: self.t0 + np.concatenate(([0], self.seg['time_cum'])).astype(np.int64),
+                'Latitude': np.concatenate(([self.start[0]], self.seg['lat'])),
+                'Longitude': np.concatenate(([self.start[1]], self.seg['lon'])),
+                'Flight Level': self.alts / 100}
+
+    def initialize_emission(self, cumulative=True, surrogate=False):
+        """Does the openAP calculations after setting up base parameters.
+
+        with cumulative=False only the totals are integrated, the cumulative curves stay nan
+        surrogate=True interpolates the fuel flow in the precomputed table of the type (see FuelFlowSurrogate)
+        """
         try:
-            self.fuelFlow = FuelFlow(ac=self.type)
-            self.emission = Emission(ac=self.type)
-            self.FF = self.initializeFF()
-
-            self.CO2rate = self.calcCO2Rate() * 1e-6
-            self.H2Orate = self.calcH2ORate() * 1e-6
-            self.NOxrate = self.calcNOxRate() * 1e-6
-            self.COrate = self.calcCORate() * 1e-6
-            self.HCrate = self.calcHCRate() * 1e-6
-
-            self.CO2 = self.integrateRate(rate=self.CO2rate)
-            self.NOx = self.integrateRate(rate=self.NOxrate)
-            self.H2O = self.integrateRate(rate=self.H2Orate)
-            self.CO = self.integrateRate(rate=self.COrate)
-            self.HC = self.integrateRate(rate=self.HCrate) 
+            # the models are shared by all flights of the same type (see ModelPool)
+            self.fuelFlow = get_fuelflow(self.type)
+            self.emission = get_emission(self.type)
+            self.FF = self.initializeFF(surrogate)
+
+            # all five species in one pass (columns: CO2, H2O, NOx, CO, HC), in tons/s
+            rates = EmissionEngine(self.emission).rates(self.FF, self.spdHor, self.seg['alt'])
+            self.CO2rate, self.H2Orate, self.NOxrate, self.COrate, self.HCrate = rates.T
+
+            self.integrateEmissions(cumulative)
         except RuntimeWarning:
             print("issue during computation")    
         
         ############################################################################
     def __str__(self):
         """Defines how the object is printed with key stats."""
-        return f"Flight {self.id} | emissions: {[self.CO2[-1], self.H2O[-1], self.NOx[-1], self.HC[-1], self.CO[-1]]} | Airports: {self.Findairports(init=True)}"
-    def calcTimeDiffs(self):
+        return f"Flight {self.ID} | emissions: {[self.total('CO2'), self.total('H2O'), self.total('NOx'), self.total('HC'), self.total('CO')]} | Airports: {self.Findairports(init=True)}"
+
+    def total(self, name):
+        """total emission of one species (tons)"""
+        return self.totals[SPECIES.index(name)]
+
+    @staticmethod
+    def dropDuplicateTimes(flightData):
         """
-        calculates the timesteps of the flight in seconds
+        removes the points with an already seen timestamp (keeps the first one)
 
-        returns the array AND updates the class variable
+        accepts a dataframe or the {column: array} slice of a FlightStore
+        and returns {column: array}
         """
-        time_diffs = np.array(pd.to_datetime(self.flightData['Time Over'], format="mixed", dayfirst=True).diff().dt.total_seconds().dropna())
+        if isinstance(flightData, pd.DataFrame):
+            flightData = flightData.drop_duplicates(subset=[EPOCH_COLUMN])
+            return {col: flightData[col].to_numpy() for col in flightData.columns}
+        _, keep = np.unique(flightData[EPOCH_COLUMN], return_index=True)
+        keep.sort()
+        return {col: np.asarray(arr)[keep] for col, arr in flightData.items()}
 
+    def calcTimeDiffs(self):
+        """
+        calculates the timesteps of the flight in seconds
 
+        the timestamps are already parsed to epoch seconds when the data is loaded (see preProcess.parse_epoch)
 
-        #format="%d/%m/%Y %H:%M"
+        returns the array AND updates the class variable
+        """
+        time_diffs = np.diff(self.flightData[EPOCH_COLUMN]).astype(float)
         return time_diffs
     
     def calcDistHorizontal(self, R = 6371000):
@@ -140,66 +248,76 @@ class Flight:
 
         return spdVert
 
-    def initializeFF(self):
+    def initializeFF(self, surrogate=False):
         """
         initializes an array of fuel flow objects for each datapoint
+
+        the openap model works on arrays, so all segments are passed in one call,
+        only when that fails for an aircraft type the point by point loop is used
+        with surrogate=True the fuel flow is interpolated in the table of the type instead of calling the model
         """
-        FFArr = np.abs(np.array([self.fuelFlow.enroute(mass=self.mass, tas=spdHor, alt=alt, vs=spdVert) 
-                          for spdHor, alt, spdVert in zip(self.spdHor, np.array(self.flightData['Flight Level'])[1:]*100, self.spdVert)]))
+        if surrogate:
+            return fuelflow_surrogate(self.type, self.mass)(self.spdHor, self.seg['alt'], self.spdVert)
+        try:
+            FFArr = np.abs(np.asarray(self.fuelFlow.enroute(mass=self.mass, tas=np.asarray(self.spdHor, dtype=float),
+                                                            alt=np.asarray(self.seg['alt'], dtype=float),
+                                                            vs=np.asarray(self.spdVert, dtype=float)), dtype=float))
+            if FFArr.shape != self.seg.shape:
+                raise ValueError(f"fuel flow of shape {FFArr.shape} for {len(self.seg)} segments")
+        except Exception: # any failure of the batched model falls back to the exact old path
+            FFArr = np.abs(np.array([self.fuelFlow.enroute(mass=self.mass, tas=spdHor, alt=alt, vs=spdVert) 
+                              for spdHor, alt, spdVert in zip(self.spdHor, self.seg['alt'], self.spdVert)]))
         return FFArr
     
     def calcCO2Rate(self):
         """
         returns an array with the emission rate
         """
-        CO2rate = np.array([self.emission.co2(FF) 
-                          for FF in self.FF])
-        return CO2rate
+        return EmissionEngine(self.emission).species("CO2", self.FF, self.spdHor, self.seg['alt'])
     
     def calcH2ORate(self):
         """
         returns an array with the emission rate
         """
-        H2Orate = np.array([self.emission.h2o(FF) 
-                          for FF in self.FF])
-        return H2Orate
+        return EmissionEngine(self.emission).species("H2O", self.FF, self.spdHor, self.seg['alt'])
     
     def calcNOxRate(self):
         """
         returns an array with the emission rate
         """
-        NOxrate = np.array([self.emission.nox(FF, tas=spdHor, alt=alt) 
-                          for FF, spdHor, alt in zip(self.FF, self.spdHor, np.array(self.flightData['Flight Level'])[1:]*100)])
-        return NOxrate
+        return EmissionEngine(self.emission).species("NOx", self.FF, self.spdHor, self.seg['alt'])
     
     def calcCORate(self):
         """
         returns an array with the emission rate
         """
-        COrate = np.array([self.emission.co(FF, tas=spdHor, alt=alt) 
-                          for FF, spdHor, alt in zip(self.FF, self.spdHor, np.array(self.flightData['Flight Level'])[1:]*100)])
-        return COrate
+        return EmissionEngine(self.emission).species("CO", self.FF, self.spdHor, self.seg['alt'])
     
     def calcHCRate(self):
         """
         returns an array with the emission rate
         """
-        HCrate = np.array([self.emission.hc(FF, tas=spdHor, alt=alt) 
-                          for FF, spdHor, alt in zip(self.FF, self.spdHor, np.array(self.flightData['Flight Level'])[1:]*100)])
-        return HCrate
+        return EmissionEngine(self.emission).species("HC", self.FF, self.spdHor, self.seg['alt'])
     
     def integrateRate(self, rate, init=0):
         """
         a wrapper for integrating the rates, different methods of integrations can be added here
         the integration will be done in tons
         """
-        rate = np.abs(rate)
-        arr = np.zeros(len(rate))  # Same size as velocity
+        return integrate_rates(rate, self.time_diffs) + init
 
-        # Compute trapezoidal integration step by step
-        for i in range(1, len(rate)):  # Start from 1 since first position is 0
-            arr[i] = arr[i-1] + 0.5 * (rate[i-1] + rate[i]) * self.time_diffs[i-1]
-        return arr
+    def integrateEmissions(self, cumulative=True):
+        """
+        integrates the five rates at once, fills the totals
+        and (if cumulative) the cumulative curves CO2, H2O, NOx, CO and HC
+        """
+        rates = np.column_stack([self.seg[name + "rate"] for name in SPECIES])
+        if cumulative:
+            cum = integrate_rates(rates, self.time_diffs)
+            self.CO2, self.H2O, self.NOx, self.CO, self.HC = cum.T
+            self.totals = cum[-1] if len(cum) else np.zeros(len(SPECIES))
+        else:
+            self.totals = integrate_rates(rates, self.time_diffs, totals=True)
     
     def plotFlightData(self, x=[]):
         """
@@ -240,6 +358,8 @@ class Flight:
         if len(x)==0:
             x=self.time_cum
         if tot==True:
+            if len(self.seg) and np.isnan(self.CO2).all() and self.seg.flags.writeable:
+                self.integrateEmissions() # only the totals were computed
             vals = [self.CO2, self.H2O, self.NOx, self.HC, self.CO]
         else:
             vals = [self.CO2rate, self.H2Orate, self.NOxrate, self.HCrate, self.COrate]
@@ -297,49 +417,106 @@ class Flight:
 
 
     def Findairports(self, init=False):
-        try:
-            fisk=0
-            #imports the airports using the coordinates from depature and arrival
-            lat_deg=np.array(self.flightData['Latitude'])
-            lon_deg=np.array(self.flightData['Longitude'])
-            if init==False:
-                print("The aircraft depatured from",Aiport_Classifier[(lat_deg[0],lon_deg[0])], "and arrived at",Aiport_Classifier[(lat_deg[-1],lon_deg[-1])]) 
-            return [Aiport_Classifier[np.ceil(lat_deg[0]*1e1),np.floor(lon_deg[0]*1e1)],Aiport_Classifier[np.ceil(lat_deg[-1]*1e1),np.floor(lon_deg[-1]*1e1)],[float(lat_deg[0]),float(lon_deg[0])],[float(lat_deg[-1]),float(lon_deg[-1])]]
-            #imports the airports using the coordinates from depature and arrival
-        except KeyError:
-            fisk=1
-            return [None, None, None, None]
-        except UnicodeEncodeError:
-            print("fisk")
-        if fisk==1:
-            try:
-                lat_deg=np.array(self.flightData['Latitude']+0.1)
-                lon_deg=np.array(self.flightData['Longitude']+0.1)
-                return [Aiport_Classifier[(np.round(lon_deg[0],1),np.round(lat_deg[0],1))],Aiport_Classifier[(np.round(lon_deg[-1],1),np.round(lat_deg[-1],1))],[lon_deg[0],lat_deg[0]],[lon_deg[-1],lat_deg[-1]]]
-            except KeyError:
-                return [None, None, None, None]
+        """
+        finds the departure and arrival airport: the nearest airport (within the cutoff of the resolver)
+        of the first and last point of the flight, None when there is no airport close enough
 
-  
+        with init=True the airports found when the flight was made are returned
+        """
+        if init==True and self.airports is not None:
+            return self.airports
+        #imports the airports using the coordinates from depature and arrival
+        lat_deg=np.array(self.flightData['Latitude'])
+        lon_deg=np.array(self.flightData['Longitude'])
+        names, _, _ = airport_resolver().resolve(lat_deg[[0, -1]], lon_deg[[0, -1]])
+        return [names[0],names[1],[float(lat_deg[0]),float(lon_deg[0])],[float(lat_deg[-1]),float(lon_deg[-1])]]
         
     def Haul(self):
-        if np.sum(self.DistHor) < 1500000:
-            return("Short-haul flight")
-        elif np.sum(self.DistHor) >= 3000000:
-            return("Long-haul flight")
-        else:
-            return("Medium-haul flight")
+        return haul_type(np.sum(self.DistHor))
         
-def create_flight(EURCTRLID, Data, string):
-    """Helper function for multiprocessing to create a Flight object."""
+def flight_row(flight):
+    """the output record of a computed flight (columns: OUTPUT_COLUMNS)"""
+    dep, arr, depCoords, arrCoords = flight.Findairports(init=True)
+    epoch = flight.flightData[EPOCH_COLUMN]
+    return [flight.ID,flight.type,dep,arr,depCoords,arrCoords,flight.total('CO2'),flight.total('NOx'),flight.time_cum[-1],round(np.sum(flight.DistHor),0),flight.Haul(),format_epoch(epoch[0]),format_epoch(epoch[-1])]
+
+def cached_row(EURCTRLID, Data, registry, airports, cache, surrogate=False):
+    """
+    looks the flight up in the result cache before anything is computed
+
+    returns the key of the flight, its output record and the cache entry (None, None when it is not in the cache)
+    """
+    type_raw = registry.get(EURCTRLID)
+    if type_raw not in aircraft_dict:
+        raise ValueError(f"Aircraft: {type_raw} not supported")
+    ac = aircraft_dict[type_raw]
+    key = flight_key(Data[EURCTRLID], ac, aircraft_dict_mass[ac], surrogate)
+    entry = cache.get(key)
+    if entry is None:
+        return key, None, None
+
+    ends, epochs, distance = entry["ends"], entry["epochs"], float(entry["distance"])
+    if airports is None:
+        names, _, _ = airport_resolver().resolve(ends[:, 0], ends[:, 1])
+        airports = [names[0], names[1], [float(ends[0, 0]), float(ends[0, 1])], [float(ends[1, 0]), float(ends[1, 1])]]
+    totals = entry["totals"]
+    return key, [EURCTRLID, ac, airports[0], airports[1], airports[2], airports[3], totals[SPECIES.index("CO2")], totals[SPECIES.index("NOx")],
+                 float(entry["time"]), round(distance, 0), haul_type(distance), format_epoch(epochs[0]), format_epoch(epochs[1])], entry
+
+def cache_flight(cache, key, flight):
+    """
+    stores the results of a computed flight in the result cache
+    """
+    points = flight.flightData
+    cache.put(key, totals=flight.totals, time=flight.time_cum[-1], distance=np.sum(flight.DistHor),
+              epochs=points[EPOCH_COLUMN][[0, -1]],
+              ends=np.column_stack((points['Latitude'][[0, -1]], points['Longitude'][[0, -1]])),
+              rates=np.column_stack([flight.seg[name + "rate"] for name in SPECIES]),
+              positions=np.column_stack((flight.seg['lat'], flight.seg['lon'], flight.seg['alt'])), time_diffs=flight.seg['time_diffs'])
+
+def _writeRecord(output, row):
+    if isinstance(output, ResultSink):
+        output.put(row)
+    elif isinstance(output, list):
+        output.append(row)
+    elif output is not None:
+        with open(output, 'a', newline='',encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(row)
+
+def create_flight(EURCTRLID, Data, output, registry, airports=None, surrogate=False, cache=None, segments=None, grid=None):
+    """Helper function for multiprocessing to create a Flight object.
+
+    output is where the output record goes: a ResultSink, a list, the path of a csv it is appended to, or None to only compute the flight
+    surrogate=True uses the fuel flow tables instead of the exact model
+    cache is a ResultCache that is consulted first, flights found there are not computed (and None is returned)
+    segments is a SegmentWriter that keeps the segment arrays, a flight from the cache is computed again when the store does not hold it yet
+    grid is an EmissionGrid the segments are added to, flights from the cache need its segments (ResultCache with store_rates=True)
+         and are computed again when they are not in the entry
+    """
     
     try:
+        key = ""
+        if cache is not None:
+            key, row, entry = cached_row(EURCTRLID, Data, registry, airports, cache, surrogate)
+            if row is not None and (segments is None or segments.has(EURCTRLID, key)) and (grid is None or "positions" in entry):
+                if grid is not None:
+                    positions = entry["positions"]
+                    grid.add_segments(positions[:, 0], positions[:, 1], positions[:, 2], entry["rates"], entry["time_diffs"])
+                _writeRecord(output, row)
+                return None
+
         #print("initializing ", EURCTRLID)
-        flight = Flight(EURCTRLID, Data) #initializes the object
-        flight.initialize_emission()  # does the calculation
-        with open(string, 'a', newline='',encoding="utf-8") as file:
-            writer = csv.writer(file)
-            row_list=[flight.ID,flight.type,flight.Findairports(init=True)[0],flight.Findairports(init=True)[1],flight.Findairports(init=True)[2],flight.Findairports(init=True)[3],flight.CO2[-1],flight.NOx[-1],flight.time_cum[-1],round(np.sum(flight.calcDistHorizontal()),0),flight.Haul(),np.array(flight.flightData['Time Over'])[0],np.array(flight.flightData['Time Over'])[-1]]
-            writer.writerow(row_list)
+        flight = Flight(EURCTRLID, Data, registry, airports) #initializes the object
+        flight.initialize_emission(cumulative=False, surrogate=surrogate)  # does the calculation, only the totals are needed for the output
+        row = flight_row(flight)
+        if cache is not None:
+            cache_flight(cache, key, flight)
+        if segments is not None:
+            segments.add(flight, key)
+        if grid is not None:
+            grid.add_flight(flight)
+        _writeRecord(output, row)
 
     except ValueError as e:
         print(e)
@@ -357,29 +534,139 @@ def create_flight(EURCTRLID, Data, string):
     
         
     return flight
+
+
+class _Additions:
+    '''
+    stands in for the segment writer and the grid in a worker process: has() answers from the keys of the store
+    when the pool started, what create_flight adds is recorded and sent back, the parent adds it to the real ones
+    (the flights are pickled without the openap models)
+    '''
+    def __init__(self, target, stored=None):
+        self.target = target
+        self.stored = stored or {}
+        self.items = []
+
+    def has(self, ID, key):
+        return bool(key) and self.stored.get(ID) == key
+
+    def add(self, *args):
+        self.items.append((self.target, "add", args))
+
+    def add_flight(self, *args):
+        self.items.append((self.target, "add_flight", args))
+
+    def add_segments(self, *args):
+        self.items.append((self.target, "add_segments", args))
+
+#state of a worker process of run_flights, set once by _initWorker instead of being sent with every flight
+_worker = {}
+
+def _initWorker(Data, registry, airports, surrogate, cache, stored, grid):
+    _worker.update(Data=Data, registry=registry, airports=airports, surrogate=surrogate, cache=cache,
+                   stored=stored, grid=grid)
+    # every worker makes the openap models of all types once, before its first flight
+    warm(sorted(set(aircraft_dict.values())))
+
+def _workerRow(EURCTRLID):
+    airports = _worker["airports"][EURCTRLID] if _worker["airports"] is not None else None
+    rows = []
+    segments = _Additions("segments", _worker["stored"]) if _worker["stored"] is not None else None
+    grid = _Additions("grid") if _worker["grid"] else None
+    create_flight(EURCTRLID, _worker["Data"], rows, _worker["registry"], airports, surrogate=_worker["surrogate"],
+                  cache=_worker["cache"], segments=segments, grid=grid)
+    # the parent is the only writer of the segment store and the grid
+    additions = (segments.items if segments is not None else []) + (grid.items if grid is not None else [])
+    return (rows[0] if rows else None), additions
+
+def run_flights(Data, registry, sink, airports=None, workers=None, chunksize=64, ordered=True, surrogate=False, cache=None, segments=None, grid=None):
+    """
+    computes all flights of Data in a pool of worker processes and puts their records in the sink (ResultSink)
+
+    only the records are sent back, the sink in the parent process is the only writer
+    a FlightStore on the column cache is sent to the workers as the cache folder and its offsets,
+    every worker maps the columns itself (no copy of the month, also with spawn on Windows)
+    workers:   number of processes (None: all cores)
+    chunksize: flights handed to a worker at once
+    ordered:   write the rows in the order of Data, otherwise as soon as they are done (faster with uneven flights)
+    cache:     ResultCache shared by the workers (they all use the same folder)
+    segments:  SegmentWriter for the segment arrays, the workers send back what to add to it
+    grid:      EmissionGrid for the segment emissions, filled in the parent in the same way
+
+    returns the number of rows written
+    """
+    IDs = Data.keys() if isinstance(Data, FlightStore) else Data["keys"]
+    workers = workers or os.cpu_count()
+    written = 0
+    # the workers only need the keys of the flights of this run that are already in the segment store
+    stored = {ID: segments.keys[ID] for ID in IDs if ID in segments.keys} if segments is not None else None
+    targets = {"segments": segments, "grid": grid}
+    with Pool(workers, initializer=_initWorker, initargs=(Data, registry, airports, surrogate, cache, stored, grid is not None)) as pool:
+        results = pool.imap(_workerRow, IDs, chunksize) if ordered else pool.imap_unordered(_workerRow, IDs, chunksize)
+        for row, additions in tqdm(results, total=len(IDs), desc=f"Computing flights ({workers} workers)", unit="flight"):
+            for target, method, args in additions:
+                getattr(targets[target], method)(*args)
+            if row is not None:
+                sink.put(row)
+                written += 1
+    return written
         
 
+def flight_endpoints(Data):
+    """
+    the first and last coordinates of every flight as arrays
+
+    returns the flight IDs and the latitudes/longitudes with shape (flights, 2) -> [first, last]
+    """
+    if isinstance(Data, FlightStore):
+        IDs = Data.ids
+        lat = np.column_stack((Data.first('Latitude'), Data.last('Latitude')))
+        lon = np.column_stack((Data.first('Longitude'), Data.last('Longitude')))
+        return IDs, lat, lon
+
+    IDs = np.array(Data["keys"], dtype=np.int64)
+    lat = np.empty((len(IDs), 2))
+    lon = np.empty((len(IDs), 2))
+    for i, ID in enumerate(Data["keys"]):
+        lat[i] = Data[ID]['Latitude'].to_numpy()[[0, -1]]
+        lon[i] = Data[ID]['Longitude'].to_numpy()[[0, -1]]
+    return IDs, lat, lon
+
+def filter_flights_by_regions(Data, regions):
+    """
+    keeps the flights that start or end inside a region, for several regions in one pass
+
+    regions: {name: (min_lat, max_lat, min_lon, max_lon)}
+
+    returns {name: filtered Data}, the flight data itself is not copied
+    (a FlightStore subset or a dictionary pointing at the same dataframes)
+    """
+    names = list(regions)
+    IDs, lat, lon = flight_endpoints(Data)
+
+    # bounds with shape (regions, 1, 1) against the endpoints (flights, 2), all regions in one expression
+    min_lat, max_lat, min_lon, max_lon = (np.array([regions[name][i] for name in names], dtype=float)[:, None, None] for i in range(4))
+    inside = ((min_lat <= lat) & (lat <= max_lat) & (min_lon <= lon) & (lon <= max_lon)).any(axis=2)
+
+    result = {}
+    for name, valid in zip(names, inside):
+        if isinstance(Data, FlightStore):
+            result[name] = Data.subset(valid)
+        else:
+            keys = IDs[valid].tolist()
+            result[name] = {key: Data[key] for key in keys}
+            result[name]["keys"] = keys
+    return result
+
 def filter_flights_by_coordinates(Data, min_lat, max_lat, min_lon, max_lon):
     print("\n--------------------removing flights out of bounds---------------------")
-    print(f"    old dataset length: {len(Data) - 2}")  # Excluding "name" and "keys"
+    old_length = len(Data) if isinstance(Data, FlightStore) else len(Data) - 2  # Excluding "name" and "keys"
+    print(f"    old dataset length: {old_length}")
 
-    def is_within_bounds(df):
-        """ Check if first or last coordinates are within bounds """
-        first_lat, first_lon = df.iloc[0][['Latitude', 'Longitude']]
-        last_lat, last_lon = df.iloc[-1][['Latitude', 'Longitude']]
-        
-        return ((min_lat <= first_lat <= max_lat and min_lon <= first_lon <= max_lon) or
-                (min_lat <= last_lat <= max_lat and min_lon <= last_lon <= max_lon))
+    Data = filter_flights_by_regions(Data, {"bounds": (min_lat, max_lat, min_lon, max_lon)})["bounds"]
 
-    # Extract only valid flight IDs, skipping the first and last items ("name" and "keys")
-    flight_entries = list(Data.items())[1:-1]  # Skip first ("name") and last ("keys")
-    valid_flight_ids = {flight_id for flight_id, df in tqdm(flight_entries, desc="eliminating flights", unit="flight") if is_within_bounds(df)}
-    
-    # Update "keys" and filter Data dictionary
-    Data = {key: Data[key] for key in valid_flight_ids}
-    Data["keys"] = list(valid_flight_ids)
-    
-    print(f"    new dataset length: {len(Data)}")  # Now only valid flights
+    new_length = len(Data) if isinstance(Data, FlightStore) else len(Data) - 1  # Excluding "keys"
+    print(f"    new dataset length: {new_length}")  # Now only valid flights
     print("--------------------done---------------------")
     
     return Data
@@ -390,56 +677,102 @@ def filter_flights_by_coordinates(Data, min_lat, max_lat, min_lon, max_lon):
 #-------------------------------------------------------------------------------------------------------------------------------------------------------------------
 if __name__ == "__main__":
 
-    #Load the data for al the required flights once
-    Data = extract_ECTRLIDSeq('Data\PositionData\FPA202109')
-    outputloc = 'Data\Outputdata/202109.csv'
-
+    parser = argparse.ArgumentParser(description="computes the emissions of every flight of a month")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted run: flights in the checkpoint are skipped and only new results are appended")
+    args = parser.parse_args()
 
+    Folder = 'Data\PositionData\FPA202109'
+    outputloc = 'Data\Outputdata/202109.csv'
+    registry = registry_for_folder(Folder) #the aircraft types of the same month
+    region = (37.623, 69.896, -23.723, 31.823) #(min_lat, max_lat, min_lon, max_lon)
+
+    stream=False #stream the flights file by file instead of loading the whole month first (flights are then not kept in memory)
+    batch=False #compute all flights of one aircraft type together (FleetKernel), only the output rows are made, no Flight objects
+    workers=1 #processes computing the flights (None: all cores), 1 keeps the Flight objects in memory
+    chunksize=64 #flights handed to a worker at once
+    ordered=True #keep the order of the flights in the output file
+    output_format="csv" #"csv" or "parquet" (a folder of part files next to outputloc, needs pyarrow)
+    surrogate=False #interpolate the fuel flow in precomputed tables per aircraft type (faster, small error, see surrogate_report)
+    #the three below write extra data for every segment, off unless needed (with save_grid and cache_results the cache also keeps the segments)
+    save_segments=False #keep the segment arrays of every flight next to the output (SegmentStore), for plotting later (not with batch)
+    save_grid=False #add the emissions of every segment to a lat x lon x altitude grid (EmissionGrid), saved next to the output
+    cache_results=False #reuse the results of flights computed before (Data/ResultCache), only new or changed flights are computed
     fil=True #decide if you want to go through the filtering process or not
+    filters = {}
     if fil==True:
-        print("\n--------------------removing invalid aircraft types---------------------")
-        print(f"    old dataset length: {len(Data)-2}")
-
-        # Convert aircraft_dict keys to a set for faster lookups
-        valid_types = set(aircraft_dict.keys())
-
-        # Get invalid IDs in a set for fast lookups
-        invalid_IDs = {id for id, type in AircraftDictionary_Eurocontrol_and_Aircraft.items() if type not in valid_types}
-
-        # Filter Data["keys"] in one go
-        Data["keys"] = [ID for ID in Data["keys"] if ID not in invalid_IDs]
-
-        # Use dictionary comprehension to remove invalid entries
-        Data = {key: value for key, value in Data.items() if key not in invalid_IDs}
-
-        print(f"    new dataset length: {len(Data)-2}")
-        print("--------------------done---------------------")
-
-        Data = filter_flights_by_coordinates(Data=Data, min_lat=37.623, max_lat=69.896, min_lon=-23.723, max_lon=31.823)
-
-    #---------------------------------------------------------------------------------------------------------------------------------------------------------------
-    print(f"--------------------initializing {len(Data)-2} flights ---------------------")
-    
-    with open(outputloc, 'w', newline='') as file:
-        writer = csv.writer(file)
-        row_list = [
-            ["EurocontrolID","Plane", "Dep","Arr", "Dep(start-coordinates)", "Arr(end-coordinates)","CO2","NOX","Time","Distance","Haul","Start-Date","End-date"],  
-        ]
-        writer.writerows(row_list)
-    
-    
-
+        #unsupported aircraft types and flights outside the region are dropped while the data is read
+        filters = dict(allowed_types=set(aircraft_dict.keys()), registry=registry, region=region)
+
+    #all the output goes through one writer that writes the records in batches (header: OUTPUT_COLUMNS)
+    #it is written to a .partial file next to the output and only moved to outputloc when the whole month is done,
+    #the checkpoint records the flights written so far so an interrupted run can be continued with --resume
+    if output_format == "parquet":
+        outputloc = os.path.splitext(outputloc)[0]
+    sink = ResultSink(outputloc + ".partial", fmt=output_format, checkpoint=outputloc + ".checkpoint", resume=args.resume)
+    if args.resume:
+        print(f"    resuming: {len(sink.done)} flights already done")
+
+    if stream==False:
+        #Load the data for al the required flights once
+        Data = extract_ECTRLIDSeq(Folder, **filters)
+        if sink.done:
+            Data = Data.subset(~np.isin(Data.ids, list(sink.done)))
+
+        #---------------------------------------------------------------------------------------------------------------------------------------------------------------
+        print(f"--------------------initializing {len(Data)} flights ---------------------")
+
+        #the airports of all flights are found in one call
+        airports = airport_resolver().resolve_flights(Data)
+
+
+    #with a grid the cache also keeps the segments of every flight, so flights from the cache can be added to it
+    cache = ResultCache(store_rates=save_grid) if cache_results else None
+    grid = EmissionGrid(region=region) if save_grid else None
+    segmentsFolder = os.path.splitext(outputloc)[0] + "_segments"
+    if grid is not None and sink.done:
+        #the flights written before the restart are added from the segment store, without it the grid would only hold the new flights
+        if save_segments and not batch and os.path.exists(segmentsFolder):
+            missing = grid.add_store(SegmentStore(segmentsFolder), sorted(sink.done))
+            if missing:
+                print(f"    {len(missing)} flights of the restart are not in the segment store, the grid is not saved")
+                grid = None
+        else:
+            print("    the grid of the flights before the restart can only be rebuilt from the segment store, the grid is not saved")
+            grid = None
+    #the store of an earlier run is kept, only flights that are new or changed are added (the batch path makes no Flight objects)
+    segments = SegmentWriter(segmentsFolder, segment_dtype(), append=True) if save_segments and not batch else None
 
     flights = []
-    for ID in tqdm(Data["keys"], desc="Initializing objects", unit="flight"):
-        obj = create_flight(ID, Data, outputloc)
-        flights.append(obj)
+    if stream==True:
+        #every flight is computed as soon as it has been read and only its result row is kept (in the output file)
+        for ID, points in tqdm(stream_ECTRLIDSeq(Folder, **filters), desc="Initializing objects", unit="flight"):
+            if ID in sink.done:
+                continue
+            create_flight(ID, {ID: points}, sink, registry, surrogate=surrogate, cache=cache, segments=segments, grid=grid)
+    elif batch==True:
+        #one pass per aircraft type over the concatenated flights, the rows come back in the order of the flights
+        for row in compute_fleet(Data, registry, airports, surrogate, grid):
+            sink.put(row)
+    elif workers != 1:
+        run_flights(Data, registry, sink, airports, workers=workers, chunksize=chunksize, ordered=ordered, surrogate=surrogate, cache=cache, segments=segments, grid=grid)
+    else:
+        for ID in tqdm(Data.keys(), desc="Initializing objects", unit="flight"):
+            obj = create_flight(ID, Data, sink, registry, airports[ID], surrogate=surrogate, cache=cache, segments=segments, grid=grid)
+            if obj is not None: #None for flights from the cache and flights that failed
+                flights.append(obj)
     
 
-    # Filter out None values
-    flights = [f for f in flights if f is not None]
+    sink.finalize(outputloc)
+    if segments is not None:
+        segments.close()
+    if grid is not None:
+        grid.save(os.path.splitext(outputloc)[0] + "_grid.npz")
 
     print("--------------------done---------------------")
+    print(f"    {sink.written} flights written to {outputloc}")
+    print(f"    openap model cache: {pool_stats()}")
+    if cache is not None:
+        print(f"    result cache: {cache.stats()}")
     print("error")
 
     #--------------------------------------------------------------------------------------------
@@ -0,0 +1,168 @@
+import numpy as np
+
+from preprocessing.preProcess import format_epoch, EPOCH_COLUMN
+from preprocessing.AircraftIDandType import aircraft_dict, aircraft_dict_mass
+from calculation.EmissionEngine import EmissionEngine, integrate_rates, SPECIES
+from calculation.ModelPool import get_fuelflow, get_emission
+from calculation.FuelFlowSurrogate import fuelflow_surrogate
+from calculation.Kinematics import kinematics, segment_mask, R_EARTH
+
+'''
+batch mode of the calculator: instead of one Flight object per flight, all flights of one
+openap type are put behind each other in long arrays and every step (distance, speeds,
+fuel flow, the five species, integration) is done once per type on those arrays
+
+the segments between the last point of a flight and the first point of the next one are
+left out, so every flight gets exactly the same numbers as with Flight/create_flight
+'''
+
+
+def haul_type(distance):
+    """
+    haul of a flight from its horizontal distance (m), works on single values and arrays
+    """
+    distance = np.asarray(distance)
+    haul = np.where(distance < 1500000, "Short-haul flight",
+                    np.where(distance >= 3000000, "Long-haul flight", "Medium-haul flight"))
+    return str(haul) if haul.ndim == 0 else haul
+
+
+def _gather(Data, positions):
+    """
+    the rows of the given flights of a FlightStore, flight after flight
+
+    returns the row numbers and for every row the index (0..len(positions)-1) of its flight
+    """
+    starts, stops = Data.starts[positions], Data.stops[positions]
+    lengths = stops - starts
+    first = np.cumsum(lengths) - lengths
+    rows = np.repeat(starts - first, lengths) + np.arange(lengths.sum())
+    return rows, np.repeat(np.arange(len(positions)), lengths)
+
+
+def _dropDuplicateTimes(flight, epoch):
+    """
+    keeps the first point of every timestamp within a flight (like Flight.dropDuplicateTimes),
+    the order of the points is not changed
+    """
+    order = np.lexsort((np.arange(len(epoch)), epoch, flight))
+    duplicate = np.zeros(len(epoch), dtype=bool)
+    duplicate[order[1:]] = (flight[order[1:]] == flight[order[:-1]]) & (epoch[order[1:]] == epoch[order[:-1]])
+    return ~duplicate
+
+
+def _fuelflow(model, mass, tas, alt, vs):
+    """
+    fuel flow for all segments in one call, point by point when the batched call fails
+    """
+    try:
+        FF = np.abs(np.asarray(model.enroute(mass=mass, tas=tas, alt=alt, vs=vs), dtype=float))
+        if FF.shape != tas.shape:
+            raise ValueError(f"fuel flow of shape {FF.shape} for {len(tas)} segments")
+    except Exception: # same fallback as Flight.initializeFF
+        FF = np.abs(np.array([model.enroute(mass=mass, tas=t, alt=a, vs=v) for t, a, v in zip(tas, alt, vs)], dtype=float))
+    return FF
+
+
+def fleet_kernel(ac, lat, lon, FL, epoch, flight, R=R_EARTH, surrogate=False, grid=None):
+    """
+    computes all flights of one openap type at once
+
+    lat, lon, FL, epoch: the points of all flights behind each other
+    flight:              for every point the index of its flight (0..n_flights-1, sorted)
+    surrogate:           interpolate the fuel flow in the table of the type (FuelFlowSurrogate)
+    grid:                EmissionGrid the emissions of every segment are added to
+
+    returns per flight: totals (n_flights x 5, tons, order of SPECIES), time (s),
+    horizontal distance (m) and the number of segments
+    """
+    n_flights = int(flight[-1]) + 1 if len(flight) else 0
+
+    # segments only between points of the same flight
+    segFlight = flight[1:][segment_mask(flight)]
+    seg = kinematics(lat, lon, FL, epoch, flight=flight, R=R)
+    time_diffs, DistHor, spdHor, spdVert, segAlt = seg['time_diffs'], seg['DistHor'], seg['spdHor'], seg['spdVert'], seg['alt']
+
+    if surrogate:
+        FF = fuelflow_surrogate(ac)(spdHor, segAlt, spdVert)
+    else:
+        FF = _fuelflow(get_fuelflow(ac), aircraft_dict_mass[ac], spdHor, segAlt, spdVert)
+    rates = EmissionEngine(get_emission(ac)).rates(FF, spdHor, segAlt)
+
+    nSeg = np.bincount(segFlight, minlength=n_flights)
+    offsets = np.concatenate(([0], np.cumsum(nSeg)))
+    totals = integrate_rates(rates, time_diffs, offsets, totals=True)
+    time = np.bincount(segFlight, weights=time_diffs, minlength=n_flights)
+    distance = np.bincount(segFlight, weights=DistHor, minlength=n_flights)
+    # added last, a type that fails has not put anything in the grid
+    if grid is not None:
+        valid = segment_mask(flight)
+        grid.add_segments(lat[1:][valid], lon[1:][valid], segAlt, rates, time_diffs, offsets)
+    return totals, time, distance, nSeg
+
+
+def compute_fleet(Data, registry, airports, surrogate=False, grid=None):
+    """
+    computes every flight of a FlightStore with one fleet_kernel call per aircraft type
+
+    airports: {ectrl_id: [dep, arr, [lat, lon], [lat, lon]]} (AirportResolver.resolve_flights)
+
+    returns the output rows (same columns as create_flight) in the order of the store,
+    flights of unsupported types or with less than two points are left out like in create_flight
+    when the kernel fails for a type, the flights of that type are computed one by one with create_flight
+    and the ones that fail there too are printed
+    """
+    types = np.array([aircraft_dict.get(t, "") for t in registry.lookup(Data.ids)])
+    IDs = Data.keys()
+    results = {}
+
+    for ac in sorted(set(types) - {""}):
+        positions = np.flatnonzero(types == ac)
+        rows, flight = _gather(Data, positions)
+        epoch = np.asarray(Data.columns[EPOCH_COLUMN])[rows]
+        keep = _dropDuplicateTimes(flight, epoch)
+        rows, flight, epoch = rows[keep], flight[keep], epoch[keep]
+
+        try:
+            totals, time, distance, nSeg = fleet_kernel(ac, np.asarray(Data.columns['Latitude'])[rows],
+                                                        np.asarray(Data.columns['Longitude'])[rows],
+                                                        np.asarray(Data.columns['Flight Level'])[rows], epoch, flight,
+                                                        surrogate=surrogate, grid=grid)
+        except Exception as e:
+            print(f"    fleet kernel failed for {ac} ({e!r}), computing its {len(positions)} flights one by one")
+            results.update(_computeSingle(Data, [IDs[pos] for pos in positions], positions, registry, airports, surrogate, grid))
+            continue
+
+        # scatter the results of this type back to the flights
+        first = np.searchsorted(flight, np.arange(len(positions)))
+        last = np.searchsorted(flight, np.arange(len(positions)), side="right") - 1
+        for i, pos in enumerate(positions):
+            if nSeg[i] == 0:
+                continue
+            ID = IDs[pos]
+            dep, arr, depCoords, arrCoords = airports[ID]
+            results[pos] = [ID, ac, dep, arr, depCoords, arrCoords,
+                            totals[i, SPECIES.index("CO2")], totals[i, SPECIES.index("NOx")], time[i],
+                            round(distance[i], 0), haul_type(distance[i]),
+                            format_epoch(epoch[first[i]]), format_epoch(epoch[last[i]])]
+
+    return [results[pos] for pos in sorted(results)]
+
+
+def _computeSingle(Data, IDs, positions, registry, airports, surrogate=False, grid=None):
+    """
+    the fallback of compute_fleet: create_flight for every flight, returns {position: row}
+    """
+    from calculation.Emmisionscalculater import create_flight
+
+    results, failed = {}, []
+    for ID, pos in zip(IDs, positions):
+        rows = []
+        create_flight(ID, Data, rows, registry, airports[ID], surrogate=surrogate, grid=grid)
+        if rows:
+            results[pos] = rows[0]
+        else:
+            failed.append(ID)
+    if failed:
+        print(f"    flights that failed: {failed}")
+    return results
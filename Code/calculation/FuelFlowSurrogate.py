@@ -0,0 +1,169 @@
+import os
+import zipfile
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from scipy.interpolate import RegularGridInterpolator
+
+from preprocessing.AircraftIDandType import aircraft_dict_mass
+from calculation.ModelPool import get_fuelflow
+
+'''
+fuel flow lookup tables: FuelFlow.enroute is evaluated once per aircraft type and mass on a grid of
+(TAS, altitude, vertical speed) and afterwards only interpolated, for bulk inventories where a small
+error is fine. The tables are saved in SURROGATE_FOLDER and reused as long as type, mass and grid match.
+
+surrogate_report compares the tables with the exact model on a month of flights
+'''
+
+SURROGATE_FOLDER = os.path.join("Data", "Surrogates")
+
+#default grid, points outside of it are clipped to the border
+TAS_GRID = np.linspace(0, 650, 66)           #kt
+ALT_GRID = np.linspace(0, 50000, 51)         #ft
+VS_GRID = np.linspace(-6000, 6000, 49)       #ft/min
+
+
+class FuelFlowSurrogate:
+    '''
+    interpolation table of the fuel flow (kg/s) of one aircraft type at one mass
+
+    table[i, j, k] = |FuelFlow.enroute(mass, tas[i], alt[j], vs[k])|
+
+    openap gives NaN below a minimum TAS (depending on type and altitude), those cells take the value
+    of the nearest finite TAS of the same altitude and vertical speed, so linear interpolation does not
+    spread the NaN to the finite speeds next to them
+    '''
+    def __init__(self, ac, mass, tas, alt, vs, table):
+        self.ac = ac
+        self.mass = mass
+        self.grid = (np.asarray(tas, dtype=float), np.asarray(alt, dtype=float), np.asarray(vs, dtype=float))
+        self.table = _fillTas(np.asarray(table, dtype=float))
+        self._interp = RegularGridInterpolator(self.grid, self.table, method="linear")
+
+    @classmethod
+    def build(cls, ac, mass=None, tas=TAS_GRID, alt=ALT_GRID, vs=VS_GRID):
+        """
+        evaluates the exact model on the whole grid in one call (mass defaults to aircraft_dict_mass)
+        """
+        mass = aircraft_dict_mass[ac] if mass is None else mass
+        T, A, V = np.meshgrid(tas, alt, vs, indexing="ij")
+        FF = get_fuelflow(ac).enroute(mass=mass, tas=T.ravel(), alt=A.ravel(), vs=V.ravel())
+        return cls(ac, mass, tas, alt, vs, np.abs(np.asarray(FF, dtype=float)).reshape(T.shape))
+
+    def __call__(self, tas, alt, vs):
+        """
+        interpolated fuel flow for arrays of TAS (kt), altitude (ft) and vertical speed (ft/min)
+        """
+        points = [np.clip(np.asarray(values, dtype=float), axis[0], axis[-1]) for values, axis in zip((tas, alt, vs), self.grid)]
+        return self._interp(np.column_stack(points))
+
+    def inside(self, tas, alt, vs):
+        """
+        True for the points within the grid (the others are clipped by __call__)
+        """
+        inside = True
+        for values, axis in zip((tas, alt, vs), self.grid):
+            values = np.asarray(values, dtype=float)
+            inside = inside & (values >= axis[0]) & (values <= axis[-1])
+        return inside
+
+    def save(self, folder=SURROGATE_FOLDER):
+        """
+        written to a temporary file first, so other processes never read half a table
+        """
+        os.makedirs(folder, exist_ok=True)
+        path = _surrogatePath(self.ac, self.mass, folder)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as file:
+            np.savez(file, ac=self.ac, mass=self.mass, tas=self.grid[0], alt=self.grid[1], vs=self.grid[2], table=self.table)
+        try:
+            os.replace(tmp, path)
+        except PermissionError:
+            # the table is open in another process (Windows), which already wrote the same table
+            os.remove(tmp)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(str(f["ac"]), float(f["mass"]), f["tas"], f["alt"], f["vs"], f["table"])
+
+
+def _fillTas(table):
+    """
+    replaces the non-finite cells of a (tas, alt, vs) table by the nearest finite cell along the TAS axis,
+    columns without any finite value stay NaN
+    """
+    finite = np.isfinite(table)
+    if finite.all():
+        return table
+    n = table.shape[0]
+    index = np.arange(n).reshape((n,) + (1,) * (table.ndim - 1))
+    below = np.maximum.accumulate(np.where(finite, index, -1), axis=0)
+    above = np.flip(np.minimum.accumulate(np.flip(np.where(finite, index, n), axis=0), axis=0), axis=0)
+    useAbove = (below < 0) | ((above < n) & (above - index < index - below))
+    nearest = np.clip(np.where(useAbove, above, below), 0, n - 1)
+    filled = np.take_along_axis(table, nearest, axis=0)
+    return np.where(finite, table, filled)
+
+
+def _surrogatePath(ac, mass, folder=SURROGATE_FOLDER):
+    return os.path.join(folder, f"FF_{ac}_{int(round(mass))}.npz")
+
+
+@lru_cache(maxsize=None)
+def fuelflow_surrogate(ac, mass=None, folder=SURROGATE_FOLDER):
+    """
+    the table of a type (one per process), loaded from disk or built and saved on first use
+    """
+    mass = aircraft_dict_mass[ac] if mass is None else mass
+    path = _surrogatePath(ac, mass, folder)
+    if os.path.exists(path):
+        try:
+            surrogate = FuelFlowSurrogate.load(path)
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            surrogate = None # a damaged file (for example left by a crash) is built again
+        if surrogate is not None and all(np.array_equal(a, b) for a, b in zip(surrogate.grid, (TAS_GRID, ALT_GRID, VS_GRID))):
+            return surrogate
+    surrogate = FuelFlowSurrogate.build(ac, mass)
+    surrogate.save(folder)
+    return surrogate
+
+
+def surrogate_report(Data, registry, max_flights=None):
+    """
+    error of the tables against the exact model on a month of flights (FlightStore),
+    per aircraft type over all segments and over the total fuel of every flight
+
+    returns a dataframe with one row per type:
+        segments, flights, share of the segments outside the grid,
+        max/mean absolute error (kg/s), mean relative error of the fuel flow,
+        max/mean relative error of the total fuel of a flight
+    """
+    from calculation.Emmisionscalculater import Flight
+
+    per_type = {}
+    for ID in Data.keys()[:max_flights]:
+        try:
+            flight = Flight(ID, Data, registry)
+        except (ValueError, IndexError):
+            continue
+        if len(flight.seg) == 0:
+            continue
+        flight.fuelFlow = get_fuelflow(flight.type)
+        exact = flight.initializeFF()
+        approx = flight.initializeFF(surrogate=True)
+        fuel_exact, fuel_approx = np.nansum(exact * flight.time_diffs), np.nansum(approx * flight.time_diffs)
+        stats = per_type.setdefault(flight.type, {"err": [], "rel": [], "fuel": [], "outside": []})
+        stats["outside"].append(~fuelflow_surrogate(flight.type, flight.mass).inside(flight.spdHor, flight.seg['alt'], flight.spdVert))
+        stats["err"].append(np.abs(approx - exact))
+        stats["rel"].append(np.abs(approx - exact) / np.maximum(exact, 1e-6))
+        stats["fuel"].append(abs(fuel_approx - fuel_exact) / fuel_exact if fuel_exact > 0 else np.nan)
+
+    rows = []
+    for ac, stats in sorted(per_type.items()):
+        err, rel, fuel = np.concatenate(stats["err"]), np.concatenate(stats["rel"]), np.array(stats["fuel"])
+        rows.append({"type": ac, "segments": len(err), "flights": len(fuel), "outside grid": np.concatenate(stats["outside"]).mean(),
+                     "max abs error": np.nanmax(err), "mean abs error": np.nanmean(err), "mean rel error": np.nanmean(rel),
+                     "max rel error fuel": np.nanmax(fuel), "mean rel error fuel": np.nanmean(fuel)})
+    return pd.DataFrame(rows)
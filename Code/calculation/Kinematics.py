@@ -0,0 +1,104 @@
+import numpy as np
+
+'''
+the kinematics of the segments between flightpoints in one pass over the raw columns:
+time step, time since the first point, haversine distance, climb, ground speed and vertical speed
+
+works on a single flight or on many flights behind each other (flight = index of the flight of every point),
+the results are written into preallocated arrays (for example the segment array of a Flight) and
+the intermediate steps reuse a few work arrays instead of making new ones for every step
+'''
+
+R_EARTH = 6371000 #m
+
+#fields written by kinematics, segment i runs from point i to point i+1 (alt is the altitude of point i+1)
+KINEMATIC_FIELDS = ("time_diffs", "time_cum", "alt", "DistHor", "DistVert", "spdHor", "spdVert")
+
+
+def kinematics_dtype(dtype=np.float64):
+    return np.dtype([(name, dtype) for name in KINEMATIC_FIELDS])
+
+
+def segment_mask(flight):
+    """
+    True for the segments between two points of the same flight
+    """
+    flight = np.asarray(flight)
+    return flight[1:] == flight[:-1]
+
+
+def kinematics(lat, lon, FL, epoch, flight=None, out=None, R=R_EARTH):
+    """
+    lat, lon (deg), FL (flight level) and epoch (s) of the points, deduplicated in time
+
+    flight: None for a single flight, otherwise the (sorted) index of the flight of every point,
+            the segments across two flights are left out and time_cum starts at 0 for every flight
+    out:    anything with the KINEMATIC_FIELDS as out[name] (a structured array, the seg of a Flight, a dict of arrays),
+            allocated when None
+
+    units: s, s, ft, m, ft, kt, ft/min (the same as the calc methods of Flight)
+    returns out
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    epoch = np.asarray(epoch)
+    n = max(len(epoch) - 1, 0)
+    valid = None if flight is None else segment_mask(flight)
+    if out is None:
+        out = np.empty(n if valid is None else int(valid.sum()), dtype=kinematics_dtype())
+
+    # a single flight is written straight into out, a batch is computed over all point pairs first
+    if valid is None:
+        dst = {name: out[name] for name in KINEMATIC_FIELDS}
+    else:
+        dst = dict(zip(KINEMATIC_FIELDS, np.empty((len(KINEMATIC_FIELDS), n))))
+    work = np.empty((3, n))
+    a, b, c = work
+
+    # haversine
+    lat_rad = np.radians(lat)
+    lon_rad = np.radians(lon)
+    np.subtract(lat_rad[1:], lat_rad[:-1], out=a)
+    np.divide(a, 2, out=a)
+    np.sin(a, out=a)
+    np.square(a, out=a)
+    np.subtract(lon_rad[1:], lon_rad[:-1], out=b)
+    np.divide(b, 2, out=b)
+    np.sin(b, out=b)
+    np.square(b, out=b)
+    np.cos(lat_rad, out=lat_rad)
+    np.multiply(lat_rad[:-1], lat_rad[1:], out=c)
+    np.multiply(c, b, out=b)
+    np.add(a, b, out=a)                     # a = haversine of the central angle
+    np.subtract(1, a, out=b)
+    np.sqrt(b, out=b)
+    np.sqrt(a, out=a)
+    np.arctan2(a, b, out=a)
+    np.multiply(a, 2, out=a)
+    np.multiply(a, R, out=dst["DistHor"])
+
+    # time
+    np.subtract(epoch[1:], epoch[:-1], out=dst["time_diffs"], casting="unsafe")
+    if valid is None:
+        np.subtract(epoch[1:], epoch[0] if len(epoch) else 0, out=dst["time_cum"], casting="unsafe")
+    else:
+        # epoch of the first point of the flight of every segment
+        flight = np.asarray(flight)
+        first = np.searchsorted(flight, flight[1:])
+        np.subtract(epoch[1:], epoch[first], out=dst["time_cum"], casting="unsafe")
+
+    # altitude and climb
+    alt = np.multiply(FL, 100, dtype=float)
+    dst["alt"][...] = alt[1:]
+    np.subtract(alt[1:], alt[:-1], out=dst["DistVert"])
+
+    # speeds
+    np.divide(dst["DistHor"], dst["time_diffs"], out=dst["spdHor"])
+    np.multiply(dst["spdHor"], 1.943844, out=dst["spdHor"])
+    np.divide(dst["DistVert"], dst["time_diffs"], out=dst["spdVert"])
+    np.multiply(dst["spdVert"], 60, out=dst["spdVert"])
+
+    if valid is not None:
+        for name in KINEMATIC_FIELDS:
+            out[name][...] = dst[name][valid]
+    return out
@@ -0,0 +1,59 @@
+from openap import FuelFlow, Emission
+
+#process-local cache of the openap FuelFlow and Emission models
+#making a model reads the aircraft and engine files, a month has ~100k flights but only ~30 types (aircraft_dict_mass),
+#so every model is made once per process (key: kind, aircraft type, engine, options) and shared by all flights of that type
+
+_models = {}
+_stats = {"hits": 0, "misses": 0}
+
+
+def _get(kind, cls, ac, eng, options):
+    key = (kind, ac, eng, tuple(sorted(options.items())))
+    model = _models.get(key)
+    if model is None:
+        _stats["misses"] += 1
+        model = cls(ac=ac, eng=eng, **options)
+        _models[key] = model
+    else:
+        _stats["hits"] += 1
+    return model
+
+
+def get_fuelflow(ac, eng=None, **options):
+    """
+    the FuelFlow model of an aircraft type (made on first use)
+    """
+    return _get("fuelflow", FuelFlow, ac, eng, options)
+
+
+def get_emission(ac, eng=None, **options):
+    """
+    the Emission model of an aircraft type (made on first use)
+    """
+    return _get("emission", Emission, ac, eng, options)
+
+
+def warm(types, eng=None, **options):
+    """
+    makes the models of all given types up front, for example once when a worker process starts
+    """
+    for ac in types:
+        get_fuelflow(ac, eng, **options)
+        get_emission(ac, eng, **options)
+
+
+def pool_stats():
+    """
+    hits, misses and number of models in the cache of this process
+    """
+    return dict(_stats, models=len(_models))
+
+
+def clear():
+    """
+    empties the cache and resets the counters
+    """
+    _models.clear()
+    _stats["hits"] = 0
+    _stats["misses"] = 0
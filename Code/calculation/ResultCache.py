@@ -0,0 +1,155 @@
+import os
+import zipfile
+import hashlib
+from importlib.metadata import version, PackageNotFoundError
+import numpy as np
+
+from preprocessing.preProcess import EPOCH_COLUMN
+
+'''
+disk cache of the results of single flights, keyed by what the result depends on:
+the trajectory points, the openap type and mass, the openap version and CODE_VERSION
+(and whether the fuel flow tables were used). Rerunning a month after a change in the
+post-processing, or with extra flights, only computes the flights that are not in the cache yet.
+
+an entry is one npz file named after the sha256 key, the least recently used entries
+(file mtime, touched on every hit) are removed when the folder grows above max_bytes
+'''
+
+RESULT_CACHE_FOLDER = os.path.join("Data", "ResultCache")
+CODE_VERSION = "1" #change when the calculation changes, all older entries are then missed
+
+#the columns of the flightpoints that go into the key
+KEY_COLUMNS = (EPOCH_COLUMN, "Latitude", "Longitude", "Flight Level")
+
+
+def _openapVersion():
+    try:
+        return version("openap")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def flight_key(points, ac, mass, surrogate=False):
+    """
+    sha256 of the flightpoints ({column: array} or dataframe), type, mass, versions and options
+    """
+    h = hashlib.sha256()
+    h.update(f"{ac}|{float(mass)!r}|{_openapVersion()}|{CODE_VERSION}|{bool(surrogate)}".encode())
+    for col in KEY_COLUMNS:
+        values = np.ascontiguousarray(np.asarray(points[col]), dtype=np.int64 if col == EPOCH_COLUMN else np.float64)
+        h.update(col.encode())
+        h.update(values.tobytes())
+    return h.hexdigest()
+
+
+class ResultCache:
+    '''
+    one entry per flight:
+        totals:   total emission per species (tons, order of SPECIES)
+        time:     flight time (s)
+        distance: horizontal distance (m)
+        epochs:   first and last epoch of the (deduplicated) points
+        ends:     [[lat, lon] first point, [lat, lon] last point]
+        with store_rates=True also the segments (enough to add the flight to an EmissionGrid):
+        rates:      the emission rates of every segment (segments x species)
+        positions:  lat, lon, alt (ft) of every segment (segments x 3)
+        time_diffs: time step of every segment (s)
+    '''
+    def __init__(self, folder=RESULT_CACHE_FOLDER, max_bytes=2 * 1024**3, store_rates=False):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.store_rates = store_rates
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], key + ".npz")
+
+    def get(self, key):
+        """
+        the entry as {name: array}, None when it is not in the cache
+
+        an entry that can not be read (cut off by a crash or a full disk) is removed, so it is written again
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as f:
+                entry = {name: f[name] for name in f.files}
+            os.utime(path) # most recently used
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            self.misses += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, totals, time, distance, epochs, ends, rates=None, positions=None, time_diffs=None):
+        """
+        stores an entry (written to a temporary file first, so a crash never leaves half an entry)
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = dict(totals=totals, time=time, distance=distance, epochs=epochs, ends=ends)
+        if self.store_rates and rates is not None:
+            entry.update(rates=rates, positions=positions, time_diffs=time_diffs)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as file:
+            np.savez(file, **entry)
+        os.replace(tmp, path)
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.folder):
+            return entries
+        for shard in os.scandir(self.folder):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".npz"):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError: # removed by another process
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        """
+        bytes used by all entries
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_bytes=None):
+        """
+        removes the least recently used entries until the cache is below max_bytes
+        (by default to 90% of the limit, so not every new entry causes an eviction)
+        """
+        max_bytes = int(self.max_bytes * 0.9) if max_bytes is None else max_bytes
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in entries:
+            if size <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self._size = size
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
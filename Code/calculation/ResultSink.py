@@ -0,0 +1,230 @@
+import os
+import csv
+import json
+import shutil
+import time
+import queue
+import threading
+
+#columns of the output file, every record is a list/tuple in this order (or a dict with these keys)
+OUTPUT_COLUMNS = ["EurocontrolID", "Plane", "Dep", "Arr", "Dep(start-coordinates)", "Arr(end-coordinates)",
+                  "CO2", "NOX", "Time", "Distance", "Haul", "Start-Date", "End-date"]
+
+_CLOSE = object()
+
+
+class ResultSink:
+    '''
+    the single writer of the output: records are put on a queue and a background thread
+    writes them in batches, so the file is opened once and never written by two flights at the same time
+
+    fmt:
+        "csv":     one csv file with a header row (the old output)
+        "parquet": a folder with one part-NNNNN.parquet file per batch (needs pyarrow)
+
+    a batch is written when it has batch_size records or flush_seconds after its first record
+    use it as a context manager, leaving the block writes the last batch and closes the file
+        with ResultSink(outputloc) as sink:
+            sink.put(row)
+
+    checkpoint: file where the ECTRL IDs of every written batch are recorded, together with the size of
+                the output after that batch (bytes of the csv, number of parquet parts)
+    resume:     continue the output of an interrupted run: everything after the last checkpoint is cut off
+                and the IDs that were already written are in done (so they can be skipped).
+                A run that stopped while finalizing gets its moved output back, when the output is gone
+                the checkpoint can not be used and everything is written again
+    '''
+    def __init__(self, path, fmt="csv", batch_size=1000, flush_seconds=5.0, append=False, maxsize=10000,
+                 checkpoint=None, resume=False):
+        if fmt not in ("csv", "parquet"):
+            raise ValueError(f"unknown output format: {fmt}, choose from ['csv', 'parquet']")
+        if fmt == "parquet":
+            import pyarrow  # noqa: F401 (fail here and not in the writer thread when it is missing)
+        self.path = path
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.append = append
+        self.checkpoint = checkpoint
+        self.written = 0
+        self.done = set()
+        if checkpoint is not None:
+            if resume:
+                self.done, offset, final = read_checkpoint(checkpoint)
+                if final is not None and not os.path.exists(path) and os.path.exists(final):
+                    # stopped between moving the output and removing the checkpoint: continue with the moved output
+                    os.replace(final, path)
+                if offset is not None and os.path.exists(path):
+                    _truncateOutput(path, fmt, offset)
+                    self.append = True
+                elif offset is not None:
+                    self.done = set()
+                    os.remove(checkpoint)
+            elif os.path.exists(checkpoint):
+                os.remove(checkpoint)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="ResultSink", daemon=True)
+        self._thread.start()
+
+    def put(self, record):
+        """
+        hands one output record to the writer
+        """
+        if self._error is not None:
+            raise RuntimeError("the result writer stopped") from self._error
+        if isinstance(record, dict):
+            record = [record[col] for col in OUTPUT_COLUMNS]
+        self._queue.put(record)
+
+    def close(self):
+        """
+        writes what is left and waits for the writer
+        """
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+        if self._error is not None:
+            raise RuntimeError("the result writer stopped") from self._error
+
+    def finalize(self, final_path):
+        """
+        closes the sink and moves the finished output to final_path in one step (os.replace),
+        so final_path never holds a half written month, the checkpoint is removed afterwards
+
+        final_path is recorded in the checkpoint first, so a resume after a crash in between finds the output
+        """
+        self.close()
+        self._writeCheckpoint({"final": final_path})
+        if os.path.isdir(final_path):
+            # a folder (parquet) can only be replaced by a rename when the old one is gone
+            shutil.rmtree(final_path)
+        os.replace(self.path, final_path)
+        if self.checkpoint is not None and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def _checkpoint(self, batch, offset):
+        """
+        records a batch after it is on disk
+        """
+        self._writeCheckpoint({"offset": offset, "ids": [int(record[0]) for record in batch]})
+
+    def _writeCheckpoint(self, entry):
+        if self.checkpoint is None:
+            return
+        with open(self.checkpoint, 'a', encoding="utf-8") as file:
+            file.write(json.dumps(entry) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        try:
+            writer = self._csvWriter if self.fmt == "csv" else self._parquetWriter
+            writer()
+        except Exception as e:
+            self._error = e
+            # keep emptying the queue so put never blocks on a dead writer
+            while self._queue.get() is not _CLOSE:
+                pass
+
+    def _batches(self):
+        """
+        the records of the queue in lists of at most batch_size
+        """
+        batch, deadline = [], None
+        while True:
+            try:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+            if record is _CLOSE:
+                break
+            if record is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_seconds
+                batch.append(record)
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                yield batch
+                batch, deadline = [], None
+        if batch:
+            yield batch
+
+    def _csvWriter(self):
+        header = not (self.append and os.path.exists(self.path))
+        with open(self.path, 'a' if self.append else 'w', newline='', encoding="utf-8") as file:
+            writer = csv.writer(file)
+            if header:
+                writer.writerow(OUTPUT_COLUMNS)
+            for batch in self._batches():
+                writer.writerows(batch)
+                file.flush()
+                os.fsync(file.fileno())
+                self.written += len(batch)
+                self._checkpoint(batch, file.tell())
+
+    def _parquetWriter(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # fixed types, so every part file has the same schema (a batch without any airport would otherwise get a null column)
+        coords = pa.list_(pa.float64())
+        schema = pa.schema([("EurocontrolID", pa.int64()), ("Plane", pa.string()), ("Dep", pa.string()), ("Arr", pa.string()),
+                            ("Dep(start-coordinates)", coords), ("Arr(end-coordinates)", coords),
+                            ("CO2", pa.float64()), ("NOX", pa.float64()), ("Time", pa.float64()), ("Distance", pa.float64()),
+                            ("Haul", pa.string()), ("Start-Date", pa.string()), ("End-date", pa.string())])
+
+        os.makedirs(self.path, exist_ok=True)
+        if not self.append:
+            for name in os.listdir(self.path):
+                if name.startswith("part-") and name.endswith(".parquet"):
+                    os.remove(os.path.join(self.path, name))
+        part = len([name for name in os.listdir(self.path) if name.startswith("part-")])
+        for batch in self._batches():
+            table = pa.table({col: [record[i] for record in batch] for i, col in enumerate(OUTPUT_COLUMNS)}, schema=schema)
+            pq.write_table(table, os.path.join(self.path, f"part-{part:05d}.parquet"))
+            part += 1
+            self.written += len(batch)
+            self._checkpoint(batch, part)
+
+
+def read_checkpoint(checkpoint):
+    """
+    the ECTRL IDs written so far, the size of the output after the last complete batch
+    (None when nothing was recorded) and where finalize moved the output (None when it did not start),
+    a line cut off by a crash is ignored
+    """
+    done, offset, final = set(), None, None
+    if not os.path.exists(checkpoint):
+        return done, offset, final
+    with open(checkpoint, encoding="utf-8") as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if "final" in entry:
+                final = entry["final"]
+                continue
+            done.update(entry["ids"])
+            offset = entry["offset"]
+    return done, offset, final
+
+
+def _truncateOutput(path, fmt, offset):
+    """
+    cuts the output back to the last checkpoint: the rows after it are written again on resume
+    """
+    if fmt == "csv":
+        with open(path, 'r+b') as file:
+            file.truncate(offset)
+    else:
+        for name in os.listdir(path):
+            if name.startswith("part-") and name.endswith(".parquet") and int(name[5:10]) >= offset:
+                os.remove(os.path.join(path, name))
@@ -0,0 +1,237 @@
+import os
+import json
+import numpy as np
+
+from calculation.EmissionEngine import SPECIES
+
+'''
+keeps the segment arrays of every computed flight (times, positions, speeds, fuel flow, the five rates and
+cumulative emissions) on disk, so a flight can be plotted or analysed again without computing it
+
+layout of the folder:
+    meta.json:    the dtype of the segments
+    segments.bin: the segment records of all flights behind each other (flat binary, memory-mapped when read)
+    index.bin:    one fixed size record per flight: ECTRL ID, first and last record + 1, first point, type, totals
+                  and the key of the flight in the result cache (empty when computed without the cache)
+
+both files are only appended to, the index record of a flight is written after its segments,
+so after a crash everything up to the last complete index record can still be read.
+A rerun of the same month appends the flights that changed, for a flight written more than once the last one counts.
+When the records that are no longer used exceed COMPACT_SHARE of the store, SegmentWriter.close rewrites it
+with only the last record of every flight (SegmentWriter.compact)
+'''
+
+#share of superseded segment records above which the store is compacted when the writer is closed
+COMPACT_SHARE = 0.25
+
+INDEX_DTYPE = np.dtype([("ID", np.int64), ("start", np.int64), ("stop", np.int64), ("t0", np.int64),
+                        ("lat0", np.float64), ("lon0", np.float64), ("alt0", np.float64),
+                        ("type", "U8"), ("totals", np.float64, (len(SPECIES),)), ("key", "S64")])
+
+
+def _readDtype(folder):
+    """
+    the segment dtype of an existing store, None when there is none (or it has an older index layout)
+    """
+    path = os.path.join(folder, "meta.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        meta = json.load(file)
+    if np.dtype([tuple(field) for field in meta.get("index", [])]) != INDEX_DTYPE:
+        return None
+    return np.dtype([tuple(field) for field in meta["dtype"]])
+
+
+def _readIndex(path):
+    """
+    the complete index records (a record cut off by a crash is left out)
+    """
+    if not os.path.exists(path):
+        return np.empty(0, dtype=INDEX_DTYPE)
+    count = os.path.getsize(path) // INDEX_DTYPE.itemsize
+    return np.fromfile(path, dtype=INDEX_DTYPE, count=count)
+
+
+def _finishCompact(folder):
+    """
+    completes a compaction that was interrupted: the new segments are written first and then moved in before the new
+    index, so when only the new index is left it belongs to the segments in place, otherwise the old files are kept
+    """
+    segPath, indexPath = os.path.join(folder, "segments.bin"), os.path.join(folder, "index.bin")
+    if os.path.exists(indexPath + ".compact"):
+        if os.path.exists(segPath + ".compact"):
+            os.remove(segPath + ".compact")
+            os.remove(indexPath + ".compact")
+        else:
+            os.replace(indexPath + ".compact", indexPath)
+    elif os.path.exists(segPath + ".compact"):
+        os.remove(segPath + ".compact")
+
+
+def _lastRecords(index):
+    """
+    the positions of the last index record of every flight, in the order they are in the index
+    """
+    _, last = np.unique(index["ID"][::-1], return_index=True)
+    return np.sort(len(index) - 1 - last)
+
+
+class SegmentWriter:
+    '''
+    appends the segments of computed flights to a segment store folder
+
+    append=False starts a new store, append=True continues an existing one (a rerun or --resume),
+    the segments written after the last complete index record are cut off first.
+    A store with another dtype or index layout is started again
+    '''
+    def __init__(self, folder, dtype, append=False):
+        self.folder = folder
+        self.dtype = np.dtype(dtype)
+        os.makedirs(folder, exist_ok=True)
+        _finishCompact(folder)
+        segPath, indexPath = os.path.join(folder, "segments.bin"), os.path.join(folder, "index.bin")
+        self._segPath, self._indexPath = segPath, indexPath
+
+        if append and _readDtype(folder) == self.dtype:
+            index = _readIndex(indexPath)
+            self.records = int(index["stop"][-1]) if len(index) else 0
+            with open(indexPath, 'a+b') as file:
+                file.truncate(len(index) * INDEX_DTYPE.itemsize)
+            with open(segPath, 'a+b') as file:
+                file.truncate(self.records * self.dtype.itemsize)
+        else:
+            index = np.empty(0, dtype=INDEX_DTYPE)
+            self.records = 0
+            for path in (segPath, indexPath):
+                if os.path.exists(path):
+                    os.remove(path)
+            with open(os.path.join(folder, "meta.json"), "w") as file:
+                json.dump({"dtype": self.dtype.descr, "index": INDEX_DTYPE.descr}, file)
+
+        #the cache key and the number of segments of the last record of every flight
+        self.keys = {int(ID): key.decode() for ID, key in zip(index["ID"], index["key"])}
+        self._lengths = {int(ID): int(stop - start) for ID, start, stop in zip(index["ID"], index["start"], index["stop"])}
+        self.superseded = self.records - sum(self._lengths.values())
+
+        self._segments = open(segPath, 'ab')
+        self._index = open(indexPath, 'ab')
+
+    def has(self, ID, key):
+        """
+        True when the store already holds the flight with this result cache key
+        """
+        return bool(key) and self.keys.get(ID) == key
+
+    def add(self, flight, key=""):
+        """
+        writes the segments of a computed Flight, the cumulative emissions are integrated first when only the totals were
+
+        key is the result cache key of the flight, so a rerun can see the flight is already in the store
+        """
+        if len(flight.seg) and np.isnan(flight.seg["CO2"]).all():
+            flight.integrateEmissions(cumulative=True)
+        seg = np.ascontiguousarray(flight.seg, dtype=self.dtype)
+        self._segments.write(seg.tobytes())
+        self._segments.flush()
+
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record[0] = (flight.ID, self.records, self.records + len(seg), flight.t0,
+                     flight.start[0], flight.start[1], flight.start[2], flight.type, flight.totals, key)
+        self._index.write(record.tobytes())
+        self._index.flush()
+        self.records += len(seg)
+        self.superseded += self._lengths.get(int(flight.ID), 0)
+        self.keys[int(flight.ID)] = key
+        self._lengths[int(flight.ID)] = len(seg)
+
+    def compact(self):
+        """
+        rewrites the store with only the last record of every flight, the order of the flights is kept
+        """
+        self._segments.close()
+        self._index.close()
+        index = _readIndex(self._indexPath)
+        index = index[_lastRecords(index)]
+        segments = np.memmap(self._segPath, dtype=self.dtype, mode="r", shape=(self.records,)) if self.records else None
+
+        with open(self._segPath + ".compact", "wb") as file:
+            for start, stop in zip(index["start"], index["stop"]):
+                file.write(segments[start:stop].tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        lengths = index["stop"] - index["start"]
+        index["stop"] = np.cumsum(lengths)
+        index["start"] = index["stop"] - lengths
+        with open(self._indexPath + ".compact", "wb") as file:
+            file.write(index.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        del segments
+
+        # segments first, _finishCompact can then complete a compaction that was interrupted in between
+        os.replace(self._segPath + ".compact", self._segPath)
+        os.replace(self._indexPath + ".compact", self._indexPath)
+        self.records, self.superseded = int(lengths.sum()), 0
+        self._segments = open(self._segPath, 'ab')
+        self._index = open(self._indexPath, 'ab')
+
+    def close(self):
+        """
+        closes the files, the store is compacted first when more than COMPACT_SHARE of it is superseded
+        """
+        if self.records and self.superseded > COMPACT_SHARE * self.records:
+            self.compact()
+        self._segments.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SegmentStore:
+    '''
+    reads a segment store folder: the segments are memory-mapped,
+    so store[ID] is a view on the file (no copy) and only the pages that are used are read
+
+    when a flight was written more than once (a resumed run) the last one is used
+    '''
+    def __init__(self, folder):
+        self.folder = folder
+        _finishCompact(folder)
+        self.dtype = _readDtype(folder)
+        if self.dtype is None:
+            raise ValueError(f"no segment store (or one of an older layout) in {folder}")
+        self.index = _readIndex(os.path.join(folder, "index.bin"))
+        records = int(self.index["stop"].max()) if len(self.index) else 0
+        self.segments = np.memmap(os.path.join(folder, "segments.bin"), dtype=self.dtype, mode="r", shape=(records,)) \
+            if records else np.empty(0, dtype=self.dtype)
+        self._positions = {int(ID): i for i, ID in enumerate(self.index["ID"])}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, ID):
+        return ID in self._positions
+
+    def keys(self):
+        return list(self._positions)
+
+    def __getitem__(self, ID):
+        """
+        the segment array of a flight (read-only view on the file)
+        """
+        entry = self.index[self._positions[ID]]
+        return self.segments[entry["start"]:entry["stop"]]
+
+    def flight(self, ID):
+        """
+        the Flight rebuilt from the store (see Flight.from_segments), ready for the plot methods
+        """
+        from calculation.Emmisionscalculater import Flight
+        entry = self.index[self._positions[ID]]
+        return Flight.from_segments(ID, self[ID], str(entry["type"]), int(entry["t0"]),
+                                    (float(entry["lat0"]), float(entry["lon0"]), float(entry["alt0"])), entry["totals"])
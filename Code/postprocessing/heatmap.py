@@ -122,54 +122,151 @@ import cartopy.feature as cfeature
 import pandas as pd
 import numpy as np
 from scipy.stats import gaussian_kde
+from scipy.signal import fftconvolve
 from matplotlib.colors import LogNorm  # Import LogNorm for better scaling
 
-# Load and clean data
-df = pd.read_csv("Unique_airports_201903.csv")
-df = df.dropna()
-
-# Extract coordinates for departures and arrivals
-lat_long_list = list(zip(df['ADEP Longitude'], df['ADEP Latitude']))
-lat_long_list_arrival = list(zip(df['ADES Longitude'], df['ADES Latitude']))
-
-# Combine both departure and arrival coordinates
-all_coords = np.array(lat_long_list + lat_long_list_arrival)  # Convert to NumPy array
-
-# Create figure and set projection
-fig, ax = plt.subplots(figsize=(8, 6), subplot_kw={'projection': ccrs.PlateCarree()})
-
-# Set the extent to focus on Europe (Longitude: -25 to 45, Latitude: 34 to 72)
-ax.set_extent([-25, 45, 34, 72], crs=ccrs.PlateCarree())
-
-
-# Add land, coastlines, and borders
-ax.coastlines()
-ax.add_feature(cfeature.BORDERS, linestyle=':')
-ax.add_feature(cfeature.LAND, color='lightgray')  # Lighter land color
-ax.add_feature(cfeature.OCEAN, color='lightblue')
-
-# Generate a KDE heatmap
-x, y = all_coords[:, 0], all_coords[:, 1]  # Longitude and Latitude
-kde = gaussian_kde([x, y])  # Fit KDE model
-
-# Create a grid for the heatmap
-x_grid = np.linspace(-25, 45, 300)  # Increase points for smoother heatmap
-y_grid = np.linspace(34, 72, 300)
-X, Y = np.meshgrid(x_grid, y_grid)
-kde = gaussian_kde([x, y], bw_method=0.05)
-Z = kde(np.vstack([X.ravel(), Y.ravel()])).reshape(X.shape)  # Evaluate KDE on grid
-
-
-# Adjust the colormap & normalization
-heatmap = ax.imshow(
-    Z, extent=[-25, 45, 34, 72], origin='lower', 
-    cmap='cividis',  # 🔹 Less red, more contrast (Alternatives: 'viridis', 'coolwarm', 'inferno')
-    norm=LogNorm(vmin=Z.min() + 1e-6, vmax=Z.max()),  # 🔹 Log scaling to balance colors
-    alpha=0.7  # 🔹 Adjust transparency for better visibility
-)
-
-# Add colorbar
-cbar = plt.colorbar(heatmap, ax=ax, orientation='vertical', shrink=0.6, label="Log Density")
-
-# Show plot
-plt.show()
+EXTENT = [-25, 45, 34, 72] # Europe (Longitude: -25 to 45, Latitude: 34 to 72)
+GRID_SIZE = 300
+BW_METHOD = 0.05
+MAX_REFINE = 8 #binned_density refines each axis of the grid at most this many times
+
+
+def load_airport_coords(path="Unique_airports_201903.csv"):
+    """
+    longitudes and latitudes of all departure and arrival airports
+    """
+    df = pd.read_csv(path)
+    df = df.dropna()
+    x = np.concatenate([df['ADEP Longitude'].to_numpy(), df['ADES Longitude'].to_numpy()])
+    y = np.concatenate([df['ADEP Latitude'].to_numpy(), df['ADES Latitude'].to_numpy()])
+    return x, y
+
+
+def load_grid_points(path, species="CO2"):
+    """
+    the cells of a saved emission grid (EmissionGrid.save) as weighted points:
+    longitude and latitude of the cell centres and the emission of all altitudes in that column
+    """
+    with np.load(path) as f:
+        data = f["data"][list(f["species"]).index(species)].sum(axis=2)
+        lat = (f["lat"][:-1] + f["lat"][1:]) / 2
+        lon = (f["lon"][:-1] + f["lon"][1:]) / 2
+    lat_grid, lon_grid = np.meshgrid(lat, lon, indexing="ij")
+    keep = data > 0
+    return lon_grid[keep], lat_grid[keep], data[keep]
+
+
+def kde_density(x, y, x_grid, y_grid, weights=None, bw_method=BW_METHOD):
+    """
+    the exact gaussian KDE on the grid, every point is evaluated in every cell (points x cells)
+    """
+    X, Y = np.meshgrid(x_grid, y_grid)
+    kde = gaussian_kde([x, y], bw_method=bw_method, weights=weights)
+    return kde(np.vstack([X.ravel(), Y.ravel()])).reshape(X.shape)
+
+
+def _linearBinning(values, start, step):
+    """
+    the two grid nodes around every value and the share of the value for both (linear binning)
+    """
+    pos = (values - start) / step
+    low = np.floor(pos).astype(np.int64)
+    frac = pos - low
+    return low, low + 1, 1 - frac, frac
+
+
+def binned_density(x, y, x_grid, y_grid, weights=None, bw_method=BW_METHOD, truncate=4.0, nodes_per_sd=5):
+    """
+    the same density as kde_density in near linear time, for millions of points:
+    the points (optionally weighted, for example by CO2) are binned linearly onto the nodes of the grid
+    and the histogram is convolved with the KDE kernel using the FFT
+
+    the kernel is the one of gaussian_kde: a gaussian with the (weighted) covariance of the points times bw_method^2,
+    cut off at truncate standard deviations. x_grid and y_grid must be evenly spaced (np.linspace)
+
+    the linear binning smears a kernel that is only a few cells wide, so the binning is done on a grid
+    with at least nodes_per_sd nodes per standard deviation of the kernel (at most MAX_REFINE times finer)
+    and only the nodes of x_grid and y_grid are returned
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    weights = np.ones(len(x)) if weights is None else np.asarray(weights, dtype=float)
+    total = weights.sum()
+    cov = np.cov(np.vstack([x, y]), aweights=weights) * bw_method ** 2
+    fx = int(np.clip(np.ceil(nodes_per_sd * (x_grid[1] - x_grid[0]) / np.sqrt(cov[0, 0])), 1, MAX_REFINE))
+    fy = int(np.clip(np.ceil(nodes_per_sd * (y_grid[1] - y_grid[0]) / np.sqrt(cov[1, 1])), 1, MAX_REFINE))
+    dx, dy = (x_grid[1] - x_grid[0]) / fx, (y_grid[1] - y_grid[0]) / fy
+    mx, my = (len(x_grid) - 1) * fx + 1, (len(y_grid) - 1) * fy + 1 #nodes of the refined map
+
+    # the grid is extended by the reach of the kernel, so points just outside the map still count
+    px = int(np.ceil(truncate * np.sqrt(cov[0, 0]) / dx))
+    py = int(np.ceil(truncate * np.sqrt(cov[1, 1]) / dy))
+    nx, ny = mx + 2 * px, my + 2 * py
+    x0, y0 = x_grid[0] - px * dx, y_grid[0] - py * dy
+
+    # linear binning: every point is split over the 4 nodes around it
+    hist = np.zeros(ny * nx)
+    xl, xh, wxl, wxh = _linearBinning(x, x0, dx)
+    yl, yh, wyl, wyh = _linearBinning(y, y0, dy)
+    for xi, wx in ((xl, wxl), (xh, wxh)):
+        for yi, wy in ((yl, wyl), (yh, wyh)):
+            inside = (xi >= 0) & (xi < nx) & (yi >= 0) & (yi < ny)
+            hist += np.bincount(yi[inside] * nx + xi[inside], weights=(weights * wx * wy)[inside], minlength=ny * nx)
+    hist = hist.reshape(ny, nx) / total
+
+    # the kernel on the node offsets
+    kx, ky = np.arange(-px, px + 1) * dx, np.arange(-py, py + 1) * dy
+    KX, KY = np.meshgrid(kx, ky)
+    inv = np.linalg.inv(cov)
+    kernel = np.exp(-0.5 * (inv[0, 0] * KX ** 2 + 2 * inv[0, 1] * KX * KY + inv[1, 1] * KY ** 2))
+    kernel /= 2 * np.pi * np.sqrt(np.linalg.det(cov))
+
+    Z = fftconvolve(hist, kernel, mode="same")
+    return np.maximum(Z[py:py + my:fy, px:px + mx:fx], 0) # the FFT leaves tiny negative values
+
+
+def plot_heatmap(Z, extent=EXTENT, label="Log Density"):
+    # Create figure and set projection
+    fig, ax = plt.subplots(figsize=(8, 6), subplot_kw={'projection': ccrs.PlateCarree()})
+    ax.set_extent(extent, crs=ccrs.PlateCarree())
+
+    # Add land, coastlines, and borders
+    ax.coastlines()
+    ax.add_feature(cfeature.BORDERS, linestyle=':')
+    ax.add_feature(cfeature.LAND, color='lightgray')  # Lighter land color
+    ax.add_feature(cfeature.OCEAN, color='lightblue')
+
+    # Adjust the colormap & normalization
+    heatmap = ax.imshow(
+        Z, extent=extent, origin='lower',
+        cmap='cividis',  # 🔹 Less red, more contrast (Alternatives: 'viridis', 'coolwarm', 'inferno')
+        norm=LogNorm(vmin=Z.min() + 1e-6, vmax=Z.max()),  # 🔹 Log scaling to balance colors
+        alpha=0.7  # 🔹 Adjust transparency for better visibility
+    )
+
+    # Add colorbar
+    cbar = plt.colorbar(heatmap, ax=ax, orientation='vertical', shrink=0.6, label=label)
+
+    # Show plot
+    plt.show()
+
+
+if __name__ == "__main__":
+    engine = "fft" #"fft" (binned_density) or "kde" (the exact gaussian_kde, slow for many points)
+    grid_file = None #a saved emission grid (*_grid.npz) to plot the CO2 weighted density instead of the airports
+
+    if grid_file is None:
+        x, y = load_airport_coords("Unique_airports_201903.csv")
+        weights = None
+    else:
+        x, y, weights = load_grid_points(grid_file, "CO2")
+
+    # Create a grid for the heatmap
+    x_grid = np.linspace(EXTENT[0], EXTENT[1], GRID_SIZE)  # Increase points for smoother heatmap
+    y_grid = np.linspace(EXTENT[2], EXTENT[3], GRID_SIZE)
+    if engine == "fft":
+        Z = binned_density(x, y, x_grid, y_grid, weights=weights)
+    else:
+        Z = kde_density(x, y, x_grid, y_grid, weights=weights)
+
+    plot_heatmap(Z, label="Log Density" if weights is None else "Log CO₂ density")
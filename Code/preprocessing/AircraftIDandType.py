@@ -1,4 +1,7 @@
 
+import os
+import re
+from functools import lru_cache
 import pandas as pd # data loading in, reads csv files quickly and easily
 import matplotlib as mpl
 import openap
@@ -22,22 +25,126 @@ from pprint import pprint
  #TODO: fix this to adapt to proper file
 #AircraftDictionary_Eurocontrol_and_Aircraft= dict(zip(combined_series_ECTRL,combined_series_Plane))
 #AircraftDictionary_Eurocontrol_and_Aircraft= df.set_index(['ECTRL ID'])[('AC Type')].to_dict()
+
+AIRCRAFT_DATA_FOLDER = os.path.join("Data", "AircraftData")
+
+class AircraftRegistry:
+    '''
+    lookup between the eurocontrol number (ECTRL ID) and the aircraft type for one year and month(s)
+
+    nothing is read when the object is made, the Flights_YYYYMM.csv files are only read on first use
+    and then stored as a binary cache (Flights_YYYYMM.npz) next to them, which is used as long as
+    it is newer than the csv
+    '''
+    def __init__(self, year, months, folder=AIRCRAFT_DATA_FOLDER):
+        self.year = int(year)
+        self.months = tuple(int(m) for m in np.atleast_1d(months))
+        self.folder = folder
+        self._ids = None
+        self._types = None
+
+    def _paths(self, month):
+        name = f"Flights_{self.year}{month:02d}"
+        return os.path.join(self.folder, name + ".csv"), os.path.join(self.folder, name + ".npz")
+
+    def _loadMonth(self, month):
+        """
+        returns the (ids, types) of one month, from the binary cache when it is up to date
+        """
+        csvPath, cachePath = self._paths(month)
+        if os.path.exists(cachePath) and (not os.path.exists(csvPath) or os.path.getmtime(cachePath) >= os.path.getmtime(csvPath)):
+            with np.load(cachePath) as cached:
+                return cached["ids"], cached["types"]
+
+        df = pd.read_csv(csvPath, usecols=["ECTRL ID", "AC Type"])
+        ids = df["ECTRL ID"].to_numpy(dtype=np.int64)
+        types = df["AC Type"].fillna("").to_numpy(dtype=str)
+        np.savez(cachePath, ids=ids, types=types)
+        return ids, types
+
+    def _load(self):
+        if self._ids is not None:
+            return
+        loaded = [self._loadMonth(month) for month in self.months]
+        ids = np.concatenate([l[0] for l in loaded])
+        types = np.concatenate([l[1] for l in loaded])
+
+        #sorted for fast lookups, on duplicate ids the last file wins (like building a dict)
+        _, last = np.unique(ids[::-1], return_index=True)
+        keep = len(ids) - 1 - last
+        self._ids, self._types = ids[keep], types[keep]
+
+    @property
+    def ids(self):
+        self._load()
+        return self._ids
+
+    @property
+    def types(self):
+        self._load()
+        return self._types
+
+    def lookup(self, IDs):
+        """
+        aircraft types for an array of ECTRL IDs ("" when unknown)
+        """
+        IDs = np.asarray(IDs, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full(IDs.shape, "")
+        pos = np.minimum(np.searchsorted(self.ids, IDs), len(self.ids) - 1)
+        return np.where(self.ids[pos] == IDs, self.types[pos], "")
+
+    def get(self, ID, default=None):
+        pos = np.searchsorted(self.ids, ID)
+        if pos < len(self.ids) and self.ids[pos] == ID:
+            return str(self.types[pos])
+        return default
+
+    def __getitem__(self, ID):
+        value = self.get(ID)
+        if value is None:
+            raise KeyError(ID)
+        return value
+
+    def __contains__(self, ID):
+        return self.get(ID) is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def items(self):
+        return zip(self.ids.tolist(), self.types.tolist())
+
+    def __getstate__(self):
+        #other processes load the (small) binary cache themselves
+        state = self.__dict__.copy()
+        state["_ids"] = state["_types"] = None
+        return state
+
+@lru_cache(maxsize=None)
+def aircraft_registry(year, months):
+    """
+    one (lazy) registry per year and month(s) per process
+    """
+    return AircraftRegistry(year, months)
+
+def registry_for_folder(Folder):
+    """
+    the registry that belongs to a FPA folder, the year and month are read from its name (e.g. FPA202109)
+    """
+    match = re.search(r"(\d{4})(\d{2})", os.path.basename(os.path.normpath(Folder)))
+    if match is None:
+        raise ValueError(f"no year and month (YYYYMM) in the folder name: {Folder}")
+    return aircraft_registry(int(match.group(1)), int(match.group(2)))
+
 #This setups a dictionary with equal planes 
-def AircraftDIC(year):
+def AircraftDIC(year, months=(3, 6, 9, 12)):
     #importing the Aircraft ID (the eurocontrol number and the aircraft type)
     #Setting up the Dictionary between the eurocontrol number and aircraft type.  
-    df = pd.read_csv(f"Data\AircraftData\Flights_{year}03.csv")
-    df1 = pd.read_csv(f"Data\AircraftData\Flights_{year}06.csv")
-    df2 = pd.read_csv(f"Data\AircraftData\Flights_{year}09.csv")
-    df3 = pd.read_csv(f"Data\AircraftData\Flights_{year}12.csv")
-
-    combined_series_ECTRL = pd.concat([df["ECTRL ID"], df1["ECTRL ID"], df2["ECTRL ID"], df3["ECTRL ID"]], ignore_index=True)
-    combined_series_Plane = pd.concat([df["AC Type"], df1["AC Type"], df2["AC Type"], df3["AC Type"]], ignore_index=True)
-    AircraftDictionary_Eurocontrol_and_Aircraft= dict(zip(combined_series_ECTRL,combined_series_Plane))
+    AircraftDictionary_Eurocontrol_and_Aircraft= dict(aircraft_registry(year, tuple(months)).items())
     return AircraftDictionary_Eurocontrol_and_Aircraft
 
-AircraftDictionary_Eurocontrol_and_Aircraft = AircraftDIC(2021)
-#print(AircraftDictionary_Eurocontrol_and_Aircraft[239075328])
+#print(aircraft_registry(2021, 9)[239075328])
 
 aircraft_dict = {
     "A20N": "a20n",
@@ -152,6 +259,10 @@ mass_list = [75500,79000,97000, 68000, 75500,
     38790,
     45200
 ]
-for i in openap.prop.available_aircraft():
-    aircraft = prop.aircraft(i)
+@lru_cache(maxsize=None)
+def openap_aircraft():
+    """
+    loads the properties of every aircraft openap knows (only when asked for)
+    """
+    return {i: prop.aircraft(i) for i in openap.prop.available_aircraft()}
 
@@ -1,19 +1,115 @@
-
+import os
+from functools import lru_cache
 import pandas as pd
 import numpy as np
-df = pd.read_csv("Data\Airports\AirportsLongLat.csv")
-LatAirport=df["lat"]
-LongitudeAirport=df["lon"]
-Name_of_Airport=df["city"]
-LongitudeAirportlist=[]
-Name_of_Airportlist=[]
-LattitudeAirportlist=[]
-ID=[]
-
-Aiport_Classifier = {}
-for i in range(len(LongitudeAirport)):
-    key=np.ceil(LatAirport[i] * 1e1)
-    key1 = np.floor(LongitudeAirport[i] * 1e1)
-    value = Name_of_Airport[i]
-    Aiport_Classifier.update({(key,key1): value})
+from scipy.spatial import cKDTree
+
+AIRPORT_FILE = os.path.join("Data", "Airports", "AirportsLongLat.csv")
+R_EARTH_KM = 6371.0
+DEFAULT_MAX_KM = 15 #endpoints further than this from any airport get no airport
+
+
+def AirportGridDIC(path=AIRPORT_FILE):
+    """
+    the old lookup, keyed on the 0.1 degree cell (ceil(lat*10), floor(lon*10)) of every airport,
+    only exact cell matches are found so it is replaced by AirportResolver
+    """
+    df = pd.read_csv(path)
+    LatAirport=df["lat"]
+    LongitudeAirport=df["lon"]
+    Name_of_Airport=df["city"]
+
+    Aiport_Classifier = {}
+    for i in range(len(LongitudeAirport)):
+        key=np.ceil(LatAirport[i] * 1e1)
+        key1 = np.floor(LongitudeAirport[i] * 1e1)
+        value = Name_of_Airport[i]
+        Aiport_Classifier.update({(key,key1): value})
+    return Aiport_Classifier
+
+
+def _unitVectors(lat, lon):
+    """
+    points on the unit sphere, the straight (chord) distance between them
+    grows with the great circle distance so a normal KD-tree can be used
+    """
+    lat_rad = np.radians(np.asarray(lat, dtype=float))
+    lon_rad = np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack((np.cos(lat_rad) * np.cos(lon_rad),
+                            np.cos(lat_rad) * np.sin(lon_rad),
+                            np.sin(lat_rad)))
+
+
+class AirportResolver:
+    '''
+    finds the nearest airport of many coordinates at once with a KD-tree
+
+    kind selects which airports can be found:
+        "all":  every row of AirportsLongLat.csv
+        "iata": only airports with an IATA code (the ones with scheduled traffic),
+                the file has no airport type column so this is the closest filter
+    '''
+    def __init__(self, path=AIRPORT_FILE):
+        df = pd.read_csv(path)
+        self.lat = df["lat"].to_numpy(dtype=float)
+        self.lon = df["lon"].to_numpy(dtype=float)
+        self.names = df["city"].to_numpy(dtype=object)
+        self.icao = df["icao"].to_numpy(dtype=object)
+        self.kinds = {"all": np.arange(len(df)),
+                      "iata": np.flatnonzero(df["iata"].notna().to_numpy())}
+        self._trees = {}
+
+    def _tree(self, kind):
+        if kind not in self.kinds:
+            raise ValueError(f"unknown airport kind: {kind}, choose from {list(self.kinds)}")
+        if kind not in self._trees:
+            rows = self.kinds[kind]
+            self._trees[kind] = cKDTree(_unitVectors(self.lat[rows], self.lon[rows]))
+        return self._trees[kind]
+
+    def resolve(self, lat, lon, max_km=DEFAULT_MAX_KM, kind="all"):
+        """
+        nearest airport of every (lat, lon) in one call
+
+        returns:
+            names: city of the airport (None when there is no airport within max_km)
+            rows:  row in the airport file (-1 when none)
+            dist:  great circle distance in km (inf when none)
+        """
+        rows = self.kinds[kind]
+        # a great circle distance d matches a chord of 2 sin(d / 2R) on the unit sphere
+        chord_max = 2 * np.sin(min(max_km / R_EARTH_KM, np.pi) / 2) if max_km is not None else np.inf
+        chord, idx = self._tree(kind).query(_unitVectors(lat, lon), distance_upper_bound=chord_max)
+
+        found = np.isfinite(chord)
+        rows_found = np.full(len(idx), -1)
+        rows_found[found] = rows[idx[found]]
+        dist = np.full(len(idx), np.inf)
+        dist[found] = 2 * R_EARTH_KM * np.arcsin(np.minimum(chord[found] / 2, 1))
+
+        names = np.full(len(idx), None, dtype=object)
+        names[found] = self.names[rows_found[found]]
+        names[found & pd.isna(names)] = None
+        return names, rows_found, dist
+
+    def resolve_flights(self, Data, max_km=DEFAULT_MAX_KM, kind="all"):
+        """
+        departure and arrival airport of every flight in a FlightStore in one vectorized call
+
+        returns {ectrl_id: [departure, arrival, [lat, lon] start, [lat, lon] end]}
+        (the same layout as Flight.Findairports)
+        """
+        n = len(Data)
+        lat = np.concatenate((Data.first('Latitude'), Data.last('Latitude')))
+        lon = np.concatenate((Data.first('Longitude'), Data.last('Longitude')))
+        names, _, _ = self.resolve(lat, lon, max_km=max_km, kind=kind)
+        return {ID: [names[i], names[n + i], [float(lat[i]), float(lon[i])], [float(lat[n + i]), float(lon[n + i])]]
+                for i, ID in enumerate(Data.keys())}
+
 
+@lru_cache(maxsize=None)
+def airport_resolver(path=AIRPORT_FILE):
+    """
+    one resolver per process, the airport file is only read on first use
+    """
+    return AirportResolver(path)
@@ -0,0 +1,111 @@
+import numpy as np
+
+
+class FlightStore:
+    '''
+    keeps all the flightpoints of a month in a few contiguous numpy columns,
+    sorted by ECTRL ID, instead of one small dataframe per flight
+
+    the points of flight i are the rows starts[i]:stops[i] of every column,
+    so getting a flight is a dictionary lookup and a slice (no copy)
+
+    layout:
+        columns: {"ECTRL ID": array, "Latitude": array, ....}  (all the same length)
+        ids:     [ectrl_id 1, ectrl_id 2, ....]
+        starts:  [first row of flight 1, first row of flight 2, ....]
+        stops:   [last row + 1 of flight 1, ....]
+        folder:  the column cache the columns are memory-mapped from (None when they are in memory)
+    '''
+
+    def __init__(self, columns, ids, starts, stops, name="", folder=None):
+        self.columns = columns
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.stops = np.asarray(stops, dtype=np.int64)
+        self.name = name
+        self.folder = folder
+        self._index = None
+
+    @classmethod
+    def from_columns(cls, columns, name="", folder=None):
+        """
+        builds the store from flat columns (for example the memory-mapped cache in folder)
+
+        the rows are sorted by ECTRL ID with a stable sort, so the order of the points
+        within a flight is kept. When the rows are already sorted the columns are used as they are.
+        """
+        IDs = np.asarray(columns["ECTRL ID"])
+        if len(IDs) > 1 and np.any(IDs[1:] < IDs[:-1]):
+            order = np.argsort(IDs, kind="stable")
+            columns = {col: np.asarray(arr)[order] for col, arr in columns.items()}
+            IDs = columns["ECTRL ID"]
+            folder = None #the sorted columns are no longer the ones in the cache
+
+        #the offsets are the rows where the ECTRL ID changes
+        offsets = np.concatenate(([0], np.flatnonzero(IDs[1:] != IDs[:-1]) + 1, [len(IDs)]))
+        if len(IDs) == 0:
+            offsets = np.array([0])
+        return cls(columns, IDs[offsets[:-1]], offsets[:-1], offsets[1:], name=name, folder=folder)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, ID):
+        return ID in self.index
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, ID):
+        """
+        returns the flightpoints of one flight as {column: view}
+        """
+        i = self.index[ID]
+        start, stop = self.starts[i], self.stops[i]
+        return {col: arr[start:stop] for col, arr in self.columns.items()}
+
+    @property
+    def index(self):
+        """
+        ectrl id -> position in the store, built on first use
+        """
+        if self._index is None:
+            self._index = {int(ID): i for i, ID in enumerate(self.ids)}
+        return self._index
+
+    def keys(self):
+        return [int(ID) for ID in self.ids]
+
+    def first(self, col):
+        """
+        the first value of a column for every flight
+        """
+        return np.asarray(self.columns[col])[self.starts]
+
+    def last(self, col):
+        """
+        the last value of a column for every flight
+        """
+        return np.asarray(self.columns[col])[self.stops - 1]
+
+    def subset(self, mask):
+        """
+        returns a store with only the selected flights (boolean mask or positions),
+        the columns are shared with this store and not copied
+        """
+        return FlightStore(self.columns, self.ids[mask], self.starts[mask], self.stops[mask], name=self.name, folder=self.folder)
+
+    def __getstate__(self):
+        #the lookup dictionary is rebuilt when needed, no need to send it to other processes
+        state = self.__dict__.copy()
+        state["_index"] = None
+        #memory-mapped columns are opened again from the cache by the other process (spawn would copy the whole month)
+        if self.folder is not None:
+            state["columns"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.columns is None:
+            from preprocessing.preProcess import open_FPACache
+            self.columns = open_FPACache(self.folder)
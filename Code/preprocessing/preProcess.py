@@ -1,15 +1,285 @@
 import os #allows to communicate with operating system
+import json
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import pandas # data loading in, reads csv files quickly and easily
 import numpy as np
 
+from preprocessing.FlightStore import FlightStore
+
+#columns of the FPA flightpoint files as they are read from the csv
+FPA_COLUMNS = {
+    "ECTRL ID": np.int64,
+    "Sequence Number": np.int64,
+    "Time Over": str,
+    "Flight Level": np.float64,
+    "Latitude": np.float64,
+    "Longitude": np.float64,
+}
+#columns in the cache and the FlightStore, 'Time Over' is parsed once into seconds since 1970 (int64)
+EPOCH_COLUMN = "Epoch"
+STORE_COLUMNS = {
+    "ECTRL ID": np.int64,
+    "Sequence Number": np.int64,
+    EPOCH_COLUMN: np.int64,
+    "Flight Level": np.float64,
+    "Latitude": np.float64,
+    "Longitude": np.float64,
+}
+CACHE_VERSION = 3
+
+#formats tried (in this order) for the 'Time Over' column, the first one that fits is used for the whole file
+TIME_FORMATS = ["%d-%m-%Y %H:%M:%S", "%d-%m-%Y %H:%M", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%Y-%m-%d %H:%M:%S"]
+#format of the dates in the output files
+TIME_OUTPUT_FORMAT = "%d-%m-%Y %H:%M:%S"
+
+############################################################################################################################""
+def detect_time_format(values, sample=1000):
+    """
+    finds the format of the timestamps from a sample of the values,
+    returns None when none of TIME_FORMATS fits
+    """
+    sample = pandas.Series(values[:sample]).dropna()
+    for fmt in TIME_FORMATS:
+        try:
+            pandas.to_datetime(sample, format=fmt)
+            return fmt
+        except (ValueError, TypeError):
+            continue
+    return None
+
+def parse_epoch(values, fmt=None):
+    """
+    converts the 'Time Over' strings to int64 seconds since 1970
+
+    the format is detected once for all values (if not given), the slow mixed format parsing
+    is only used when no known format fits or the detected one fails on later values
+
+    returns the seconds and the format that was used
+    """
+    if fmt is None:
+        fmt = detect_time_format(values)
+    try:
+        times = pandas.to_datetime(values, format=fmt) if fmt is not None else None
+    except (ValueError, TypeError):
+        fmt, times = None, None
+    if times is None:
+        times = pandas.to_datetime(values, format="mixed", dayfirst=True)
+    return np.asarray(times, dtype="datetime64[s]").astype(np.int64), fmt
+
+def format_epoch(seconds):
+    """
+    epoch seconds -> date string as used in the output files
+    """
+    return time.strftime(TIME_OUTPUT_FORMAT, time.gmtime(int(seconds)))
+
+def _toStoreColumns(dat, fmt=None):
+    """
+    turns the columns read from a FPA csv into the typed STORE_COLUMNS
+
+    returns the columns and the time format that was used
+    """
+    epoch, fmt = parse_epoch(dat["Time Over"], fmt)
+    columns = {}
+    for col, dtype in STORE_COLUMNS.items():
+        columns[col] = epoch if col == EPOCH_COLUMN else np.asarray(dat[col], dtype=dtype)
+    return columns, fmt
+
+def _listFPAFiles(Folder):
+    """
+    returns the csv files in the folder in a fixed (sorted) order
+    """
+    return sorted(f for f in os.listdir(Folder) if f.lower().endswith(".csv"))
+
+def _mapFiles(function, paths, workers=1):
+    """
+    applies function to every file, in a process pool when workers > 1
+
+    the results always come back in the order of paths, so merging them
+    gives the same result as the serial loop
+    """
+    if workers is None or workers <= 1 or len(paths) <= 1:
+        return map(function, paths)
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        return list(pool.map(function, paths))
+
+def _allowedIDs(allowed_IDs=None, allowed_types=None, registry=None):
+    """
+    combines the ECTRL ID and aircraft type filters into one sorted array of allowed IDs,
+    None when everything is allowed
+    """
+    allowed = None
+    if allowed_types is not None:
+        if registry is None:
+            raise ValueError("filtering on aircraft type needs the registry of the month (AircraftRegistry)")
+        allowed = registry.ids[np.isin(registry.types, list(allowed_types))]
+    if allowed_IDs is not None:
+        IDs = np.asarray(list(allowed_IDs), dtype=np.int64)
+        allowed = IDs if allowed is None else np.intersect1d(allowed, IDs)
+    return None if allowed is None else np.unique(allowed)
+
+def _inRegion(lat, lon, region):
+    """
+    region = (min_lat, max_lat, min_lon, max_lon)
+    """
+    min_lat, max_lat, min_lon, max_lon = region
+    return (min_lat <= lat) & (lat <= max_lat) & (min_lon <= lon) & (lon <= max_lon)
+
+def _flightInRegion(points, region):
+    """
+    True when the first or last point of the flight lies in the region
+    """
+    return bool(np.any(_inRegion(points['Latitude'][[0, -1]], points['Longitude'][[0, -1]], region)))
+
+def _readFPAColumns(path, allowed=None):
+    """
+    reads one FPA csv into typed numpy columns (STORE_COLUMNS),
+    rows of flights that are not allowed are dropped before the timestamps are parsed
+    """
+    print(f'    Extracting: {os.path.basename(path)}')
+    dat = pandas.read_csv(path, usecols=list(FPA_COLUMNS))
+    if allowed is not None:
+        dat = dat[np.isin(dat['ECTRL ID'].to_numpy(), allowed)]
+    return _toStoreColumns(dat)[0]
+
+def _concatColumns(parts):
+    """
+    joins the columns of several files into one set of columns
+    """
+    return {col: np.concatenate([part[col] for part in parts]) if parts else np.array([], dtype=dtype)
+            for col, dtype in STORE_COLUMNS.items()}
+
+def _cacheFolder(Folder):
+    """
+    the cache lives next to the FPA folder so it does not get picked up as a data file
+    """
+    return os.path.normpath(Folder) + "_cache"
+
+def _fingerprint(Folder):
+    """
+    name, size and modification time of every source csv, used to detect changes
+    """
+    files = []
+    for filename in _listFPAFiles(Folder):
+        stat = os.stat(os.path.join(Folder, filename))
+        files.append([filename, stat.st_size, stat.st_mtime_ns])
+    return files
+
+def cache_FPAFolder(Folder, force=False, workers=1):
+    """
+    converts all the FPA csv files of a folder once into typed numpy columns (.npy)
+    which can later be loaded memory-mapped
+
+    the manifest stores the fingerprint of the source files, if any csv is added,
+    removed or changed the cache is rebuilt
+
+    the csv files are parsed by "workers" processes
+
+    the rows are stored sorted by ECTRL ID (stable, so the points of a flight keep their order),
+    so the FlightStore can use the memory-mapped columns as they are. When the files were not sorted
+    order.npy keeps the sorted position of every row in file order
+
+    returns the location of the cache
+    """
+    cacheFolder = _cacheFolder(Folder)
+    manifestPath = os.path.join(cacheFolder, "manifest.json")
+    fingerprint = _fingerprint(Folder)
+
+    if not force and os.path.exists(manifestPath):
+        with open(manifestPath) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == CACHE_VERSION and manifest.get("files") == fingerprint:
+            return cacheFolder
+
+    print(f"    building column cache: {cacheFolder}")
+    if os.path.exists(cacheFolder):
+        shutil.rmtree(cacheFolder)
+    os.makedirs(cacheFolder)
+
+    parts = list(_mapFiles(_readFPAColumns, [os.path.join(Folder, entry[0]) for entry in fingerprint], workers))
+    offsets = [0]
+    for part in parts:
+        offsets.append(offsets[-1] + len(part["ECTRL ID"]))
+
+    columns = _concatColumns(parts)
+    del parts
+    IDs = columns["ECTRL ID"]
+    orderName = None
+    if len(IDs) > 1 and np.any(IDs[1:] < IDs[:-1]):
+        order = np.argsort(IDs, kind="stable")
+        positions = np.empty_like(order)
+        positions[order] = np.arange(len(order))
+        orderName = "order.npy"
+        np.save(os.path.join(cacheFolder, orderName), positions)
+    else:
+        order = None
+
+    names = {}
+    for i, col in enumerate(list(columns)):
+        names[col] = f"col{i}.npy"
+        arr = columns.pop(col)
+        np.save(os.path.join(cacheFolder, names[col]), arr if order is None else arr[order])
+
+    #the manifest is written last, so a half written cache is never seen as valid
+    with open(manifestPath, "w") as f:
+        json.dump({"version": CACHE_VERSION, "files": fingerprint, "offsets": offsets, "columns": names, "order": orderName}, f)
+    return cacheFolder
+
+def open_FPACache(cacheFolder, manifest=None):
+    """
+    the columns of a built cache folder, memory-mapped: {column name: array}
+    """
+    if manifest is None:
+        with open(os.path.join(cacheFolder, "manifest.json")) as f:
+            manifest = json.load(f)
+    return {col: np.load(os.path.join(cacheFolder, name), mmap_mode="r") for col, name in manifest["columns"].items()}
+
+def load_FPAFolder(Folder, workers=1):
+    """
+    loads the columns of a FPA folder from the cache (building it when needed)
+
+    result:
+        columns: {column name: memory-mapped array}, sorted by ECTRL ID
+        files: [(filename, rows), ...] the rows of every file in the columns (in file order)
+    """
+    cacheFolder = cache_FPAFolder(Folder, workers=workers)
+    with open(os.path.join(cacheFolder, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    columns = open_FPACache(cacheFolder, manifest)
+    offsets = manifest["offsets"]
+    positions = np.load(os.path.join(cacheFolder, manifest["order"]), mmap_mode="r") if manifest["order"] else None
+    files = [(entry[0], slice(offsets[i], offsets[i + 1]) if positions is None else positions[offsets[i]:offsets[i + 1]])
+             for i, entry in enumerate(manifest["files"])]
+    return columns, files
+
 ############################################################################################################################""
-def extract_routeIDSeq(Folder):
+def _splitRouteFile(path):
+    """
+    reads one file with route IDs and splits it into a dataframe per route
+    """
+    print(f'Extracting: {os.path.basename(path)}')
+    dat = pandas.read_csv(path)
+
+    #find the rows where a new flight begins
+    dat['group'] = (dat['Sequence Number'] == 1).cumsum()
+
+    # Split into multiple DataFrames
+    split_dfs = [group.drop(columns=['group']).reset_index(drop=True) for _, group in dat.groupby('group')]
+    return dat, split_dfs
+
+def extract_routeIDSeq(Folder, workers=1):
     '''
     This file loads all the documents in the "Data" folder into a dictionary structure to be used in other files
     the dictionary allows to organise the snippets of the full data with the original file
 
     runs with datafiles that include routeID and sequence number
 
+    with workers > 1 the files are parsed in a process pool,
+    the result is the same as with the serial loop
+
 
     result:
 
@@ -32,19 +302,12 @@ def extract_routeIDSeq(Folder):
     DB = np.array([])
     # iterate over files in
     # that directory
-    for filename in os.listdir(Folder):
-        print(f'Extracting: {filename}')
-        dat = pandas.read_csv(os.path.join(Folder, filename))
-
+    filenames = os.listdir(Folder)
+    results = _mapFiles(_splitRouteFile, [os.path.join(Folder, filename) for filename in filenames], workers)
+    for filename, (dat, split_dfs) in zip(filenames, results):
         #adds filename and data to database
         DB = np.append(DB,{"name": filename, "full_data": dat})
 
-        #find the rows where a new flight begins
-        dat['group'] = (dat['Sequence Number'] == 1).cumsum()
-
-        # Split into multiple DataFrames
-        split_dfs = [group.drop(columns=['group']).reset_index(drop=True) for _, group in dat.groupby('group')]
-
         # Display the split DataFrames
         for flight in split_dfs:
             DB[-1].update({flight['Route ID'][0]: flight})
@@ -54,17 +317,67 @@ def extract_routeIDSeq(Folder):
     return DB
 ##################################################################################################################################
 
-def extract_ECTRLIDSeq(Folder):
+def _split_ECTRLIDSeq(dat, DB, allowed=None, region=None):
+    """
+    splits the flightpoints of one file into a dataframe per flight and adds them to the database (or a new dictionary)
+
+    flights that are not allowed or do not start or end in the region are dropped before splitting
+    """
+    if allowed is not None:
+        dat = dat[np.isin(dat['ECTRL ID'].to_numpy(), allowed)].copy()
+
+    #parse the timestamps once for the whole file
+    if EPOCH_COLUMN not in dat.columns:
+        dat[EPOCH_COLUMN] = parse_epoch(dat['Time Over'])[0]
+
+    #find the rows where a new flight begins
+    dat['group'] = (dat['Sequence Number'] == 0).cumsum()
+
+    if region is not None:
+        grouped = dat.groupby('group')[['Latitude', 'Longitude']]
+        first, last = grouped.first(), grouped.last()
+        inside = (_inRegion(first['Latitude'], first['Longitude'], region) |
+                  _inRegion(last['Latitude'], last['Longitude'], region))
+        dat = dat[dat['group'].isin(first.index[inside.to_numpy()])]
+
+    # Split into multiple DataFrames
+    split_dfs = [group.drop(columns=['group']).reset_index(drop=True) for _, group in dat.groupby('group')]
+
+    # Display the split DataFrames
+    for flight in split_dfs:
+        DB.update({int(flight['ECTRL ID'][0]): flight})
+    return DB
+
+def _splitECTRLFile(path, allowed=None, region=None):
+    """
+    reads one FPA csv and splits it into a dataframe per flight
+    """
+    print(f'    Extracting: {os.path.basename(path)}')
+    return _split_ECTRLIDSeq(pandas.read_csv(path), {}, allowed, region)
+
+def extract_ECTRLIDSeq(Folder, cache=True, store=True, workers=1, allowed_IDs=None, allowed_types=None, registry=None, region=None):
     '''
    this function will load all the files in a folder 
    (make sure to go as far down as possible)
     then it creates a database for that last folder
 
+    with cache=True the csv files are only parsed the first time,
+    after that the typed column cache is loaded memory-mapped (see cache_FPAFolder)
+
+    with store=True the flights are kept in a FlightStore (contiguous columns sorted by ECTRL ID),
+    with store=False the old dictionary with one dataframe per flight is returned
 
+    with workers > 1 the csv files are parsed in a process pool of that size,
+    the per file results are merged in file order so the result is the same as with workers=1
+
+    filters applied while loading, so flights that are not needed are never split or stored:
+        allowed_IDs:   only keep these ECTRL IDs
+        allowed_types: only keep flights of these aircraft types (needs the registry of the month)
+        region:        (min_lat, max_lat, min_lon, max_lon), only keep flights that start or end in it
 
     result:
 
-    DB:
+    DB (store=False):
         ->dictionary per data file:
             {name: ....
              (ectrl_id 1): .....
@@ -81,28 +394,104 @@ def extract_ECTRLIDSeq(Folder):
     if not os.path.exists(Folder):
         print(" Invalid Directory, please check spelling or \,/")
         quit()
-    DB = {"name": Folder.split("/")[-1]}
-    # iterate over files in
-    # that directory
-    for filename in os.listdir(Folder):
-        print(f'    Extracting: {filename}')
-        dat = pandas.read_csv(os.path.join(Folder, filename))
+    name = Folder.split("/")[-1]
+    allowed = _allowedIDs(allowed_IDs, allowed_types, registry)
 
-        #find the rows where a new flight begins
-        dat['group'] = (dat['Sequence Number'] == 0).cumsum()
+    if store:
+        if cache:
+            columns, _ = load_FPAFolder(Folder, workers=workers)
+            DB = FlightStore.from_columns(columns, name=name, folder=_cacheFolder(Folder))
+            #selecting flights of the memory-mapped store does not copy any points
+            if allowed is not None:
+                DB = DB.subset(np.isin(DB.ids, allowed))
+        else:
+            paths = [os.path.join(Folder, filename) for filename in _listFPAFiles(Folder)]
+            columns = _concatColumns(list(_mapFiles(partial(_readFPAColumns, allowed=allowed), paths, workers)))
+            DB = FlightStore.from_columns(columns, name=name)
+        if region is not None:
+            DB = DB.subset(_inRegion(DB.first('Latitude'), DB.first('Longitude'), region) |
+                           _inRegion(DB.last('Latitude'), DB.last('Longitude'), region))
 
-        # Split into multiple DataFrames
-        split_dfs = [group.drop(columns=['group']).reset_index(drop=True) for _, group in dat.groupby('group')]
+        print("\n\n-----------Done!!-----------")
+        return DB
 
-        # Display the split DataFrames
-        for flight in split_dfs:
-            DB.update({int(flight['ECTRL ID'][0]): flight})
+    DB = {"name": name}
+    if cache:
+        columns, files = load_FPAFolder(Folder, workers=workers)
+        for filename, rows in files:
+            print(f'    Loading: {filename}')
+            if allowed is not None and isinstance(rows, slice):
+                rows = rows.start + np.flatnonzero(np.isin(columns['ECTRL ID'][rows], allowed))
+            elif allowed is not None:
+                rows = rows[np.isin(columns['ECTRL ID'][rows], allowed)]
+            dat = pandas.DataFrame({col: np.asarray(arr[rows]) for col, arr in columns.items()})
+            _split_ECTRLIDSeq(dat, DB, region=region)
+    else:
+        # iterate over files in
+        # that directory
+        paths = [os.path.join(Folder, filename) for filename in _listFPAFiles(Folder)]
+        for flights in _mapFiles(partial(_splitECTRLFile, allowed=allowed, region=region), paths, workers):
+            DB.update(flights)
     DB.update({"keys": list(DB.keys())[1:]})
 
     print("\n\n-----------Done!!-----------")
     return DB
 ##################################################################################################################################
 
+def stream_ECTRLIDSeq(Folder, chunksize=200000, allowed_IDs=None, allowed_types=None, registry=None, region=None):
+    '''
+    generator version of extract_ECTRLIDSeq: reads the files in the folder in chunks
+    and yields every flight as soon as its last point has been read,
+    so only one chunk (plus the unfinished flight) is in memory at a time
+
+    a flight ends where the next one begins (Sequence Number == 0) or at the end of the file,
+    the points of a flight that runs over a chunk border are kept and joined with the next chunk
+
+    the filters are the same as for extract_ECTRLIDSeq, rows of flights that are not allowed
+    are dropped from every chunk before anything else is done with them
+
+    yields:
+        (ectrl_id, {column: array})
+    '''
+    if not os.path.exists(Folder):
+        print(" Invalid Directory, please check spelling or \,/")
+        quit()
+    allowed = _allowedIDs(allowed_IDs, allowed_types, registry)
+
+    for filename in _listFPAFiles(Folder):
+        print(f'    Streaming: {filename}')
+        carry = None
+        fmt = None #the time format is detected on the first chunk of the file
+        for chunk in pandas.read_csv(os.path.join(Folder, filename), usecols=list(FPA_COLUMNS), chunksize=chunksize):
+            if allowed is not None:
+                chunk = chunk[np.isin(chunk['ECTRL ID'].to_numpy(), allowed)]
+            columns, fmt = _toStoreColumns(chunk, fmt)
+            if carry is not None:
+                columns = {col: np.concatenate((carry[col], arr)) for col, arr in columns.items()}
+
+            #rows where a new flight begins, the flight after the last border might continue in the next chunk
+            borders = np.flatnonzero(columns['Sequence Number'] == 0)
+            borders = borders[borders > 0]
+            last = borders[-1] if len(borders) else 0
+            yield from _yieldFlights(columns, np.concatenate(([0], borders)), last, region)
+            carry = {col: arr[last:] for col, arr in columns.items()}
+
+        #the end of the file also ends the last flight
+        if carry is not None and len(carry['ECTRL ID']):
+            yield from _yieldFlights(carry, np.array([0]), len(carry['ECTRL ID']), region)
+
+def _yieldFlights(columns, starts, end, region=None):
+    """
+    yields the flights that start at the given rows, the last one stops at row end
+    """
+    stops = np.append(starts[1:], end)
+    for start, stop in zip(starts, stops):
+        if stop > start:
+            points = {col: arr[start:stop] for col, arr in columns.items()}
+            if region is None or _flightInRegion(points, region):
+                yield int(columns['ECTRL ID'][start]), points
+##################################################################################################################################
+
 #print(extract_ECTRLIDSeq('Data/PositionData/March')["keys"])
 
 
@@ -0,0 +1,82 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+#the modules are imported the same way as in the scripts, with the Code directory on the path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+'''
+small synthetic months for the tests: FPA csv files like the eurocontrol ones and a registry,
+so nothing from the Data folder is needed
+'''
+
+#types of the flights in turn, XXXX is not supported
+TYPES = ["A320", "B738", "E190", "XXXX", "A21N", "B77W"]
+
+
+class Registry:
+    '''
+    stands in for AircraftRegistry: ECTRL ID -> aircraft type
+    '''
+    def __init__(self, types):
+        self.types = dict(types)
+
+    def get(self, ID, default=None):
+        return self.types.get(int(ID), default)
+
+    def lookup(self, IDs):
+        return np.array([self.types.get(int(ID), "") for ID in IDs])
+
+
+def make_flights(n_flights=12, seed=0, first_id=239000001):
+    """
+    {ECTRL ID: dataframe of the FPA columns} with climb, cruise and descent at airliner speeds
+    """
+    rng = np.random.default_rng(seed)
+    flights = {}
+    for ID in range(first_id, first_id + n_flights):
+        n = int(rng.integers(8, 30))
+        seconds = np.cumsum(np.r_[0, rng.integers(40, 300, n - 1)])
+        times = pd.Timestamp("2021-09-01") + pd.to_timedelta(int(rng.integers(0, 40000)) * 60 + seconds, unit="s")
+        climb = n // 3
+        FL = np.concatenate([np.linspace(0, 350, climb), np.full(n - 2 * climb, 350.0), np.linspace(350, 0, climb)])
+        heading = rng.uniform(0, 2 * np.pi)
+        travelled = seconds * 0.0022 # degrees at about 450 kt
+        lat = rng.uniform(42, 58) + travelled * np.cos(heading)
+        lon = rng.uniform(-5, 20) + travelled * np.sin(heading)
+        flights[ID] = pd.DataFrame({"ECTRL ID": ID, "Sequence Number": np.arange(n),
+                                    "Time Over": times.strftime("%d-%m-%Y %H:%M:%S"),
+                                    "Flight Level": FL, "Latitude": lat, "Longitude": lon})
+    return flights
+
+
+def write_month(folder, flights, n_files=3, interleave=False):
+    """
+    writes the flights to n_files FPA csv files, with interleave the IDs are not sorted over the files
+    """
+    os.makedirs(folder, exist_ok=True)
+    IDs = list(flights)
+    for f in range(n_files):
+        part = IDs[f::n_files] if interleave else IDs[f * len(IDs) // n_files:(f + 1) * len(IDs) // n_files]
+        pd.concat([flights[ID] for ID in part]).to_csv(os.path.join(folder, f"Flight_Points_Actual_{f}.csv"), index=False)
+    return folder
+
+
+@pytest.fixture
+def flights():
+    return make_flights()
+
+
+@pytest.fixture
+def registry(flights):
+    return Registry({ID: TYPES[i % len(TYPES)] for i, ID in enumerate(flights)})
+
+
+@pytest.fixture
+def month(tmp_path, flights):
+    """
+    the folder of a synthetic month (the name needs YYYYMM like the real ones)
+    """
+    return write_month(str(tmp_path / "FPA202109"), flights)
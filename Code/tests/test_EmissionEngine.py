@@ -0,0 +1,50 @@
+import numpy as np
+from scipy.integrate import cumulative_trapezoid
+
+from calculation.EmissionEngine import integrate_rates, integration_steps, SPECIES
+
+
+def _reference(rates, time_diffs):
+    """
+    scipy on the times of the points (the time step after the last point is not used)
+    """
+    t = np.concatenate(([0.0], np.cumsum(time_diffs[:-1])))
+    return cumulative_trapezoid(np.abs(rates), x=t, axis=0, initial=0)
+
+
+def _flight(rng, n):
+    return rng.normal(size=(n, len(SPECIES))), rng.uniform(10, 300, n)
+
+
+def test_single_flight_matches_scipy():
+    rates, time_diffs = _flight(np.random.default_rng(1), 50)
+    np.testing.assert_allclose(integrate_rates(rates, time_diffs), _reference(rates, time_diffs), rtol=1e-12)
+    np.testing.assert_allclose(integrate_rates(rates[:, 2], time_diffs), _reference(rates[:, 2], time_diffs), rtol=1e-12)
+    np.testing.assert_allclose(integrate_rates(rates, time_diffs, totals=True), _reference(rates, time_diffs)[-1], rtol=1e-12)
+
+
+def test_concatenated_flights_match_scipy():
+    rng = np.random.default_rng(2)
+    parts = [_flight(rng, n) for n in (7, 1, 0, 30, 2)]
+    rates = np.concatenate([p[0] for p in parts])
+    time_diffs = np.concatenate([p[1] for p in parts])
+    offsets = np.concatenate(([0], np.cumsum([len(p[1]) for p in parts])))
+
+    cum = integrate_rates(rates, time_diffs, offsets)
+    totals = integrate_rates(rates, time_diffs, offsets, totals=True)
+    assert totals.shape == (len(parts), len(SPECIES))
+    for i, (r, dt) in enumerate(parts):
+        if len(dt) == 0:
+            np.testing.assert_array_equal(totals[i], 0)
+            continue
+        expected = _reference(r, dt)
+        np.testing.assert_allclose(cum[offsets[i]:offsets[i + 1]], expected, rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(totals[i], expected[-1], rtol=1e-12, atol=1e-12)
+
+
+def test_steps_add_up_to_totals():
+    rates, time_diffs = _flight(np.random.default_rng(3), 20)
+    offsets = np.array([0, 5, 20])
+    steps = integration_steps(rates, time_diffs, offsets)
+    np.testing.assert_array_equal(steps[offsets[:-1]], 0)
+    np.testing.assert_allclose(np.add.reduceat(steps, offsets[:-1], axis=0), integrate_rates(rates, time_diffs, offsets, totals=True))
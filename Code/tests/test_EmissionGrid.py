@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from calculation.EmissionGrid import EmissionGrid, merge_grids
+from calculation.EmissionEngine import SPECIES, integrate_rates
+
+REGION = (40.0, 60.0, -10.0, 20.0)
+
+
+def _points(seed, n=500):
+    """
+    positions partly outside the region and above the grid, and a few unknown ones
+    """
+    rng = np.random.default_rng(seed)
+    lat, lon, alt = rng.uniform(35, 65, n), rng.uniform(-15, 25, n), rng.uniform(0, 50000, n)
+    lat[:5] = np.nan
+    return lat, lon, alt, rng.uniform(0, 1e-3, (n, len(SPECIES)))
+
+
+def test_add_conserves_totals():
+    lat, lon, alt, emissions = _points(0)
+    grid = EmissionGrid(region=REGION)
+    grid.add(lat, lon, alt, emissions)
+    for s, name in enumerate(SPECIES):
+        assert grid.total(name) == pytest.approx(emissions[:, s].sum(), rel=1e-12)
+    assert grid.outside[0] > 0 and grid.data[0].sum() > 0
+
+
+def test_add_matches_point_by_point():
+    lat, lon, alt, emissions = _points(1)
+    grid = EmissionGrid(region=REGION)
+    grid.add(lat, lon, alt, emissions)
+
+    expected = np.zeros_like(grid.data)
+    for i in range(len(lat)):
+        index = [np.searchsorted(edge, value, side="right") - 1 for edge, value in zip(grid.edges, (lat[i], lon[i], alt[i]))]
+        if all(0 <= j < size for j, size in zip(index, grid.shape)):
+            expected[(slice(None),) + tuple(index)] += emissions[i]
+    np.testing.assert_allclose(grid.data, expected, rtol=1e-12)
+
+
+def test_add_segments_matches_integrated_totals():
+    lat, lon, alt, _ = _points(2, 60)
+    rng = np.random.default_rng(2)
+    rates, time_diffs = rng.uniform(0, 1e-4, (60, len(SPECIES))), rng.uniform(10, 300, 60)
+    offsets = np.array([0, 20, 21, 60])
+    grid = EmissionGrid(region=REGION)
+    grid.add_segments(lat, lon, alt, rates, time_diffs, offsets)
+    totals = integrate_rates(rates, time_diffs, offsets, totals=True).sum(axis=0)
+    for s, name in enumerate(SPECIES):
+        assert grid.total(name) == pytest.approx(totals[s], rel=1e-12)
+    assert grid.flights == 3
+
+
+def test_merge_and_saved_grids_add_up(tmp_path):
+    whole, parts = EmissionGrid(region=REGION), []
+    for seed in range(3):
+        lat, lon, alt, emissions = _points(seed)
+        whole.add(lat, lon, alt, emissions)
+        part = EmissionGrid(region=REGION)
+        part.add(lat, lon, alt, emissions)
+        parts.append(part)
+
+    merged = EmissionGrid(region=REGION)
+    for part in parts:
+        merged += part
+    np.testing.assert_allclose(merged.data, whole.data, rtol=1e-12)
+    np.testing.assert_allclose(merged.outside, whole.outside, rtol=1e-12)
+
+    paths = [str(tmp_path / f"grid{i}.npz") for i in range(len(parts))]
+    for part, path in zip(parts, paths):
+        part.save(path)
+    loaded = merge_grids(paths)
+    np.testing.assert_allclose(loaded.data, whole.data, rtol=1e-12)
+    for name in SPECIES:
+        assert loaded.total(name) == pytest.approx(whole.total(name), rel=1e-12)
+
+
+def test_merge_needs_the_same_cells():
+    with pytest.raises(ValueError):
+        EmissionGrid(region=REGION).merge(EmissionGrid(region=REGION, dlat=1.0))
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import calculation.FleetKernel as FleetKernel
+from calculation.FleetKernel import compute_fleet
+from calculation.Emmisionscalculater import create_flight
+from calculation.EmissionGrid import EmissionGrid
+from calculation.EmissionEngine import SPECIES
+from preprocessing.preProcess import extract_ECTRLIDSeq
+
+
+@pytest.fixture
+def store(month):
+    return extract_ECTRLIDSeq(month)
+
+
+@pytest.fixture
+def airports(store):
+    lat, lon = store.first("Latitude"), store.first("Longitude")
+    lat1, lon1 = store.last("Latitude"), store.last("Longitude")
+    return {ID: ["DEP", "ARR", [lat[i], lon[i]], [lat1[i], lon1[i]]] for i, ID in enumerate(store.keys())}
+
+
+def _singleRows(store, registry, airports, grid=None):
+    rows = []
+    for ID in store.keys():
+        create_flight(ID, store, rows, registry, airports[ID], grid=grid)
+    return rows
+
+
+def _assertSameRows(rows, expected):
+    assert [row[:6] for row in rows] == [row[:6] for row in expected]
+    assert [row[10:] for row in rows] == [row[10:] for row in expected]
+    np.testing.assert_allclose(np.array([row[6:10] for row in rows], dtype=float),
+                               np.array([row[6:10] for row in expected], dtype=float), rtol=1e-9, equal_nan=True)
+
+
+def test_fleet_matches_single_flights(store, registry, airports):
+    single = _singleRows(store, registry, airports)
+    assert len(single) > 0 and np.isfinite(np.array([row[6:10] for row in single], dtype=float)).all()
+    _assertSameRows(compute_fleet(store, registry, airports), single)
+
+
+def test_fleet_grid_matches_single_flights(store, registry, airports):
+    fleet, single = EmissionGrid(), EmissionGrid()
+    compute_fleet(store, registry, airports, grid=fleet)
+    _singleRows(store, registry, airports, grid=single)
+    np.testing.assert_allclose(fleet.data, single.data, rtol=1e-9, atol=1e-15)
+    for name in SPECIES:
+        assert fleet.total(name) == pytest.approx(single.total(name), rel=1e-9)
+
+
+def test_failed_type_falls_back_to_single_flights(store, registry, airports, monkeypatch, capsys):
+    kernel = FleetKernel.fleet_kernel
+
+    def failing(ac, *args, **kwargs):
+        if ac == "b738":
+            raise MemoryError("no memory for b738")
+        return kernel(ac, *args, **kwargs)
+
+    monkeypatch.setattr(FleetKernel, "fleet_kernel", failing)
+    grid = EmissionGrid()
+    rows = compute_fleet(store, registry, airports, grid=grid)
+    assert "fleet kernel failed for b738" in capsys.readouterr().out
+    _assertSameRows(rows, _singleRows(store, registry, airports))
+    assert grid.flights == len(rows)
@@ -0,0 +1,57 @@
+import pickle
+import numpy as np
+import pytest
+
+from preprocessing.preProcess import extract_ECTRLIDSeq, STORE_COLUMNS
+from preprocessing.FlightStore import FlightStore
+from conftest import write_month
+
+
+def _assertSameFlights(store, DB):
+    assert isinstance(store, FlightStore)
+    assert sorted(store.keys()) == sorted(DB["keys"])
+    for ID in DB["keys"]:
+        points = store[ID]
+        for col in STORE_COLUMNS:
+            np.testing.assert_array_equal(points[col], DB[ID][col].to_numpy(), err_msg=f"{ID} {col}")
+
+
+@pytest.mark.parametrize("interleave", [False, True])
+@pytest.mark.parametrize("cache", [False, True])
+def test_store_matches_dataframes(tmp_path, flights, interleave, cache):
+    folder = write_month(str(tmp_path / "FPA202109"), flights, interleave=interleave)
+    store = extract_ECTRLIDSeq(folder, cache=cache, store=True)
+    DB = extract_ECTRLIDSeq(folder, cache=cache, store=False)
+    _assertSameFlights(store, DB)
+    assert np.all(np.diff(store.ids) > 0)
+
+
+def test_first_last_and_subset(month):
+    store = extract_ECTRLIDSeq(month, store=True)
+    DB = extract_ECTRLIDSeq(month, store=False, cache=False)
+    np.testing.assert_array_equal(store.first("Latitude"), [DB[ID]["Latitude"].iloc[0] for ID in store.keys()])
+    np.testing.assert_array_equal(store.last("Epoch"), [DB[ID]["Epoch"].iloc[-1] for ID in store.keys()])
+
+    mask = np.arange(len(store)) % 2 == 0
+    subset = store.subset(mask)
+    assert subset.keys() == store.keys()[::2]
+    for ID in subset.keys():
+        np.testing.assert_array_equal(subset[ID]["Longitude"], store[ID]["Longitude"])
+
+
+def test_allowed_IDs(month, flights):
+    allowed = list(flights)[1::3]
+    store = extract_ECTRLIDSeq(month, store=True, allowed_IDs=allowed)
+    DB = extract_ECTRLIDSeq(month, store=False, allowed_IDs=allowed)
+    assert store.keys() == sorted(allowed)
+    _assertSameFlights(store, DB)
+
+
+def test_pickle_reopens_cache(month):
+    store = extract_ECTRLIDSeq(month, store=True)
+    assert store.folder is not None
+    copy = pickle.loads(pickle.dumps(store))
+    assert copy.keys() == store.keys()
+    for ID in store.keys():
+        for col in STORE_COLUMNS:
+            np.testing.assert_array_equal(copy[ID][col], store[ID][col])
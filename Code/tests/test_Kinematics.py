@@ -0,0 +1,56 @@
+import numpy as np
+
+from calculation.Kinematics import kinematics, segment_mask, KINEMATIC_FIELDS, R_EARTH
+from preprocessing.preProcess import parse_epoch
+
+
+def _columns(flights):
+    """
+    the columns of every flight: {column: [array of flight 1, array of flight 2, ...]}
+    """
+    columns = {col: [flight[col].to_numpy() for flight in flights.values()] for col in ("Latitude", "Longitude", "Flight Level")}
+    columns["Epoch"] = [parse_epoch(flight["Time Over"])[0] for flight in flights.values()]
+    return columns
+
+
+def test_single_flight_against_formulas(flights):
+    points = next(iter(flights.values()))
+    lat, lon, FL = points["Latitude"].to_numpy(), points["Longitude"].to_numpy(), points["Flight Level"].to_numpy()
+    epoch = parse_epoch(points["Time Over"])[0]
+    seg = kinematics(lat, lon, FL, epoch)
+
+    phi, lam = np.radians(lat), np.radians(lon)
+    a = np.sin(np.diff(phi) / 2) ** 2 + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(np.diff(lam) / 2) ** 2
+    dist = 2 * R_EARTH * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    dt = np.diff(epoch).astype(float)
+    np.testing.assert_allclose(seg["DistHor"], dist, rtol=1e-12)
+    np.testing.assert_array_equal(seg["time_diffs"], dt)
+    np.testing.assert_array_equal(seg["time_cum"], np.cumsum(dt))
+    np.testing.assert_array_equal(seg["alt"], FL[1:] * 100)
+    np.testing.assert_allclose(seg["spdHor"], dist / dt * 1.943844, rtol=1e-12)
+    np.testing.assert_allclose(seg["spdVert"], np.diff(FL * 100) / dt * 60, rtol=1e-12)
+
+
+def test_batch_matches_single_flights(flights):
+    columns = _columns(flights)
+    flight = np.repeat(np.arange(len(flights)), [len(lat) for lat in columns["Latitude"]])
+    batch = kinematics(*(np.concatenate(columns[col]) for col in ("Latitude", "Longitude", "Flight Level", "Epoch")), flight=flight)
+
+    assert len(batch) == int(segment_mask(flight).sum()) == len(flight) - len(flights)
+    start = 0
+    for i in range(len(flights)):
+        single = kinematics(*(columns[col][i] for col in ("Latitude", "Longitude", "Flight Level", "Epoch")))
+        for name in KINEMATIC_FIELDS:
+            np.testing.assert_allclose(batch[name][start:start + len(single)], single[name], rtol=1e-12, err_msg=name)
+        start += len(single)
+
+
+def test_writes_into_given_arrays(flights):
+    points = next(iter(flights.values()))
+    args = (points["Latitude"].to_numpy(), points["Longitude"].to_numpy(), points["Flight Level"].to_numpy(),
+            parse_epoch(points["Time Over"])[0])
+    out = {name: np.full(len(points) - 1, np.nan) for name in KINEMATIC_FIELDS}
+    assert kinematics(*args, out=out) is out
+    expected = kinematics(*args)
+    for name in KINEMATIC_FIELDS:
+        np.testing.assert_array_equal(out[name], expected[name])
@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import pytest
+
+from calculation.ResultCache import ResultCache, flight_key
+
+
+def _put(cache, key, value=1.0, segments=4):
+    cache.put(key, totals=np.full(5, value), time=3600.0, distance=5e5, epochs=np.array([0, 3600]),
+              ends=np.array([[52.3, 4.8], [51.5, -0.5]]), rates=np.ones((segments, 5)),
+              positions=np.ones((segments, 3)), time_diffs=np.ones(segments))
+
+
+def _key(i):
+    return f"{i:02x}" + "0" * 62
+
+
+def test_put_get_and_stats(tmp_path):
+    cache = ResultCache(str(tmp_path), store_rates=True)
+    assert cache.get(_key(1)) is None
+    _put(cache, _key(1), 2.0)
+    entry = cache.get(_key(1))
+    np.testing.assert_array_equal(entry["totals"], np.full(5, 2.0))
+    assert entry["positions"].shape == (4, 3)
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+    plain = ResultCache(str(tmp_path / "plain"))
+    _put(plain, _key(1))
+    assert "rates" not in plain.get(_key(1))
+
+
+@pytest.mark.parametrize("damage", ["truncate", "empty", "garbage"])
+def test_corrupt_entry_is_a_miss_and_removed(tmp_path, damage):
+    cache = ResultCache(str(tmp_path))
+    _put(cache, _key(1))
+    path = cache._path(_key(1))
+    data = open(path, "rb").read()
+    with open(path, "wb") as file:
+        file.write({"truncate": data[:len(data) // 2], "empty": b"", "garbage": b"not an npz file"}[damage])
+
+    assert cache.get(_key(1)) is None
+    assert cache.stats() == {"hits": 0, "misses": 1}
+    assert not os.path.exists(path)
+    _put(cache, _key(1))
+    assert cache.get(_key(1)) is not None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    for i in range(10):
+        _put(cache, _key(i))
+        os.utime(cache._path(_key(i)), (1000 + i, 1000 + i))
+    entry_size = os.path.getsize(cache._path(_key(0)))
+    assert cache.size() == 10 * entry_size
+
+    cache.get(_key(0)) # the oldest entry is used again
+    cache.evict(max_bytes=3 * entry_size)
+    assert cache.size() <= 3 * entry_size
+    assert [cache.get(_key(i)) is not None for i in range(10)] == [True] + [False] * 7 + [True, True]
+
+
+def test_put_evicts_above_max_bytes(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    _put(cache, _key(0))
+    cache.max_bytes = 5 * os.path.getsize(cache._path(_key(0)))
+    for i in range(1, 20):
+        _put(cache, _key(i))
+    assert cache.size() <= cache.max_bytes
+    assert cache.get(_key(19)) is not None
+
+
+def test_key_depends_on_points_type_and_options(flights):
+    points = next(iter(flights.values()))
+    points = points.assign(Epoch=np.arange(len(points)) * 60)
+    key = flight_key(points, "a320", 75500)
+    assert key == flight_key(points.copy(), "a320", 75500)
+    moved = points.assign(Latitude=points["Latitude"] + 1e-9)
+    assert len({key, flight_key(moved, "a320", 75500), flight_key(points, "b738", 75500),
+                flight_key(points, "a320", 70000), flight_key(points, "a320", 75500, surrogate=True)}) == 5
@@ -0,0 +1,98 @@
+import os
+import pandas as pd
+import pytest
+
+import calculation.ResultSink as ResultSinkModule
+from calculation.ResultSink import ResultSink, read_checkpoint, OUTPUT_COLUMNS
+
+ROWS = [[239000000 + i, "a320", "EHAM", "EGLL", [52.3, 4.8], [51.5, -0.5], 10.0 + i, 0.1 * i, 3600.0 + i, 370000.0,
+         "Short-haul flight", "01-09-2021 10:00:00", "01-09-2021 11:00:00"] for i in range(10)]
+
+
+def _sink(tmp_path, fmt="csv", resume=False):
+    path = str(tmp_path / ("out" if fmt == "parquet" else "out.csv"))
+    return ResultSink(path + ".partial", fmt=fmt, batch_size=3, flush_seconds=3600, checkpoint=path + ".checkpoint",
+                      resume=resume), path
+
+
+def _read(path, fmt):
+    return pd.read_parquet(path) if fmt == "parquet" else pd.read_csv(path)
+
+
+@pytest.fixture(params=["csv", "parquet"])
+def fmt(request):
+    if request.param == "parquet":
+        pytest.importorskip("pyarrow")
+    return request.param
+
+
+def test_finalize_moves_output_and_removes_checkpoint(tmp_path, fmt):
+    sink, path = _sink(tmp_path, fmt)
+    for row in ROWS:
+        sink.put(row)
+    sink.finalize(path)
+    assert not os.path.exists(path + ".partial") and not os.path.exists(path + ".checkpoint")
+    output = _read(path, fmt)
+    assert list(output.columns) == OUTPUT_COLUMNS
+    assert output["EurocontrolID"].tolist() == [row[0] for row in ROWS]
+
+
+def test_resume_cuts_off_after_checkpoint(tmp_path, fmt):
+    sink, path = _sink(tmp_path, fmt)
+    for row in ROWS[:7]:
+        sink.put(row)
+    sink.close() # batches of 3, 3 and 1 rows
+    if fmt == "csv":
+        # a batch that was written but not checkpointed, and a checkpoint line cut off by the crash
+        with open(path + ".partial", "a") as file:
+            file.write("239999999,b738,half a row\n")
+        with open(path + ".checkpoint", "a") as file:
+            file.write('{"offset": 12')
+
+    done, offset, final = read_checkpoint(path + ".checkpoint")
+    assert done == {row[0] for row in ROWS[:7]} and final is None
+
+    sink, _ = _sink(tmp_path, fmt, resume=True)
+    assert sink.done == done
+    for row in ROWS:
+        if row[0] not in sink.done:
+            sink.put(row)
+    sink.finalize(path)
+    assert _read(path, fmt)["EurocontrolID"].tolist() == [row[0] for row in ROWS]
+
+
+def test_resume_after_crash_in_finalize(tmp_path, monkeypatch):
+    sink, path = _sink(tmp_path)
+    for row in ROWS:
+        sink.put(row)
+
+    remove = os.remove
+    def crash(name):
+        if name == path + ".checkpoint":
+            raise KeyboardInterrupt # stopped after the output was moved
+        remove(name)
+    monkeypatch.setattr(ResultSinkModule.os, "remove", crash)
+    with pytest.raises(KeyboardInterrupt):
+        sink.finalize(path)
+    monkeypatch.undo()
+
+    sink, _ = _sink(tmp_path, resume=True)
+    assert sink.done == {row[0] for row in ROWS}
+    sink.finalize(path)
+    assert _read(path, "csv")["EurocontrolID"].tolist() == [row[0] for row in ROWS]
+    assert not os.path.exists(path + ".checkpoint")
+
+
+def test_resume_without_output_starts_again(tmp_path):
+    sink, path = _sink(tmp_path)
+    for row in ROWS[:4]:
+        sink.put(row)
+    sink.close()
+    os.remove(path + ".partial")
+
+    sink, _ = _sink(tmp_path, resume=True)
+    assert sink.done == set()
+    for row in ROWS:
+        sink.put(row)
+    sink.finalize(path)
+    assert _read(path, "csv")["EurocontrolID"].tolist() == [row[0] for row in ROWS]
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cartopy") # heatmap.py imports cartopy for the maps
+from postprocessing.heatmap import kde_density, binned_density
+
+
+def _sample(seed, n=400):
+    """
+    two clusters of airports with CO2 like weights
+    """
+    rng = np.random.default_rng(seed)
+    x = np.concatenate([rng.normal(2, 3, n // 2), rng.normal(15, 5, n - n // 2)])
+    y = np.concatenate([rng.normal(50, 2, n // 2), rng.normal(45, 4, n - n // 2)])
+    return x, y, rng.uniform(0.5, 2, n)
+
+
+def _error(x, y, nx, ny, weights=None, bw_method=0.05):
+    """
+    largest difference between the binned and the exact density, relative to the peak
+    """
+    x_grid, y_grid = np.linspace(-25, 45, nx), np.linspace(34, 72, ny)
+    exact = kde_density(x, y, x_grid, y_grid, weights=weights, bw_method=bw_method)
+    binned = binned_density(x, y, x_grid, y_grid, weights=weights, bw_method=bw_method)
+    assert binned.shape == exact.shape == (ny, nx)
+    return np.abs(binned - exact).max() / exact.max()
+
+
+@pytest.mark.parametrize("bw_method", [0.05, 0.15])
+@pytest.mark.parametrize("weighted", [False, True])
+def test_binned_matches_kde(weighted, bw_method):
+    x, y, weights = _sample(0)
+    assert _error(x, y, 280, 152, weights if weighted else None, bw_method) < 0.01
+
+
+def test_narrow_kernel_is_binned_on_a_finer_grid():
+    # the kernel is about one cell wide here, binning on the map nodes alone is off by more than 10% of the peak
+    x, y, weights = _sample(2)
+    x_grid, y_grid = np.linspace(-25, 45, 280), np.linspace(34, 72, 152)
+    exact = kde_density(x, y, x_grid, y_grid, weights=weights)
+    coarse = binned_density(x, y, x_grid, y_grid, weights=weights, nodes_per_sd=0)
+    assert np.abs(coarse - exact).max() > 0.1 * exact.max()
+    assert _error(x, y, 280, 152, weights) < 0.01
+
+
+def test_density_integrates_to_one():
+    x, y, weights = _sample(1)
+    x_grid, y_grid = np.linspace(-25, 45, 280), np.linspace(34, 72, 152)
+    Z = binned_density(x, y, x_grid, y_grid, weights=weights)
+    assert (Z >= 0).all()
+    assert Z.sum() * (x_grid[1] - x_grid[0]) * (y_grid[1] - y_grid[0]) == pytest.approx(1, abs=0.01)